@@ -1,6 +1,8 @@
 """
 FastAPI Authentication Middleware
 """
+import os
+from dotenv import load_dotenv
 from fastapi import Request, HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -9,6 +11,11 @@ from typing import List, Optional, Callable
 
 from auth.jwt_utils import JWTUtils
 
+load_dotenv()
+
+# Usernames allowed to use the /api/admin endpoints; nobody when unset
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
 
 class AuthenticationMiddleware(BaseHTTPMiddleware):
     """
@@ -119,6 +126,20 @@ def get_current_user_id(request: Request) -> str:
     return user["user_id"]
 
 
+def get_current_admin(request: Request) -> dict:
+    """
+    Dependency for admin-only routes: the authenticated user must be listed
+    in ADMIN_USERNAMES.
+    """
+    user = get_current_user(request)
+    if user["username"] not in ADMIN_USERNAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return user
+
+
 async def require_auth(
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security_scheme)
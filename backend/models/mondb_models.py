@@ -14,4 +14,9 @@ class Chat(BaseModel):
     id: Optional[str] = None
     user_id: str
     last_updated: datetime
-    messages: List[BaseMessage]
\ No newline at end of file
+    messages: List[BaseMessage]
+    version: int = 0
+    # Archived chats are listed from a stub without their messages
+    archived: bool = False
+    message_count: Optional[int] = None
+    title: Optional[str] = None
\ No newline at end of file
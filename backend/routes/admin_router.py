@@ -0,0 +1,87 @@
+"""
+Admin Router - Runtime profiling and slow-request traces
+"""
+from fastapi import APIRouter, Request, HTTPException, status, Query
+from fastapi.responses import PlainTextResponse
+import os
+
+from services.profiling import SamplingProfiler, TraceRecorder
+from auth.middleware import get_current_admin
+
+
+class AdminRouter:
+    """
+    Admin-only diagnostics for the worker that serves the request.
+    Profiler state and captured traces are per worker process; every
+    response carries worker_pid so results from different workers are
+    not mixed up.
+    """
+
+    def __init__(self, recorder: TraceRecorder, profiler: SamplingProfiler = None):
+        self.router = APIRouter(prefix="/api/admin", tags=["admin"])
+        self.recorder = recorder
+        self.profiler = profiler or SamplingProfiler()
+        self._register_routes()
+
+    def _register_routes(self):
+        """Register all routes"""
+        self.router.get("/profiler")(self.profiler_status)
+        self.router.post("/profiler/start")(self.start_profiler)
+        self.router.post("/profiler/stop")(self.stop_profiler)
+        self.router.get("/profiler/flamegraph")(self.flamegraph)
+        self.router.get("/traces")(self.list_traces)
+        self.router.get("/traces/{trace_id}")(self.get_trace)
+
+    async def profiler_status(self, request: Request):
+        """State of the sampling profiler."""
+        get_current_admin(request)
+        return {"worker_pid": os.getpid(), **self.profiler.status()}
+
+    async def start_profiler(
+        self,
+        request: Request,
+        interval_ms: float = Query(10.0, ge=1.0, le=1000.0),
+        duration_seconds: float = Query(30.0, gt=0, le=SamplingProfiler.MAX_DURATION_SECONDS)
+    ):
+        """Start sampling stacks; it stops by itself after duration_seconds."""
+        get_current_admin(request)
+        if not self.profiler.start(interval_ms / 1000, duration_seconds):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Profiler is already running"
+            )
+        return {"worker_pid": os.getpid(), **self.profiler.status()}
+
+    async def stop_profiler(self, request: Request):
+        """Stop sampling; collected stacks stay available until the next start."""
+        get_current_admin(request)
+        self.profiler.stop()
+        return {"worker_pid": os.getpid(), **self.profiler.status()}
+
+    async def flamegraph(self, request: Request, idle: bool = False):
+        """Collected stacks in collapsed format (flamegraph.pl, speedscope)."""
+        get_current_admin(request)
+        return PlainTextResponse(
+            self.profiler.collapsed(include_idle=idle),
+            headers={"X-Worker-Pid": str(os.getpid())}
+        )
+
+    async def list_traces(self, request: Request, limit: int = Query(20, ge=1, le=500)):
+        """Most recent requests slower than SLOW_REQUEST_MS, without their spans."""
+        get_current_admin(request)
+        return {
+            "worker_pid": os.getpid(),
+            **self.recorder.metrics(),
+            "traces": [trace.to_dict(spans=False) for trace in self.recorder.traces(limit)]
+        }
+
+    async def get_trace(self, request: Request, trace_id: int):
+        """One captured trace with all of its spans."""
+        get_current_admin(request)
+        trace = self.recorder.get(trace_id)
+        if not trace:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Trace not found"
+            )
+        return {"worker_pid": os.getpid(), **trace.to_dict()}
@@ -1,18 +1,38 @@
 """
 Chat Router - Handles authentication, chat history, and LLM interactions
 """
-from fastapi import APIRouter, Request, HTTPException, status
+from fastapi import APIRouter, Request, HTTPException, status, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from bson import ObjectId
 from datetime import datetime
+from typing import Optional, Tuple
+from contextlib import closing
+import asyncio
+import hashlib
+import json
+import time
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_google_genai import GoogleGenerativeAI
 import os
 from dotenv import load_dotenv
 
 from services.mongodb_service import MongoDBService
+from services.llm_resilience import ResilientLLM, LLMUnavailableError, CircuitOpenError
+from services.prompt_cache import PromptCachingLLM, GeminiContextCache
+from services.model_router import TieredModelRouter, ModelTier
+from services.export_service import ChatExporter
+from services.search_service import ChatSearch
+from services.blueprint_sections import Blueprint, SECTION_LABELS, build_refine_messages
+from services.shared_state import RateLimiter
+from services.profiling import TracedRoute
 from schema.mondb_schema import ChatSchema
 from schema.chat_schema import (
     LoginRequest, TokenResponse, MessageRequest, MessageResponse,
-    ChatResponse, ChatsResponse, LLMRequest, LLMResponse, CreateChatResponse
+    ChatResponse, ChatsResponse, LLMRequest, LLMResponse, CreateChatResponse,
+    SearchResponse, SearchResult, RefineRequest, RefineResponse,
+    ChatVariant, VariantsResponse
 )
 from auth.jwt_utils import JWTUtils
 from auth.middleware import get_current_user_id
@@ -23,19 +43,76 @@ load_dotenv()
 class ChatRouter:
     """Class-based router for chat operations"""
     
+    # Completed POST /api/chat responses are replayed for this long per Idempotency-Key
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    # A key stays locked this long if its worker dies mid-turn
+    IDEMPOTENCY_LOCK_SECONDS = 300
+    # Upper bound on n for POST /api/chat/variants
+    MAX_VARIANTS = int(os.getenv("CHAT_VARIANTS_MAX", "5"))
+    # Appended to a streamed reply that the LLM stopped sending part way through
+    TRUNCATED_MARKER = "\n\n[Response interrupted]"
+    
     def __init__(self, mongo_service: MongoDBService = None):
-        self.router = APIRouter(prefix="/api", tags=["chat"])
+        self.router = APIRouter(prefix="/api", tags=["chat"], route_class=TracedRoute)
         self.mongo_service = mongo_service or MongoDBService()
-        self.llm = GoogleGenerativeAI(model="gemini-2.5-flash")
+        self.llm = TieredModelRouter(
+            fast=ModelTier(
+                name="fast",
+                llm=ResilientLLM(self._build_llm(os.getenv("LLM_FAST_MODEL", "gemini-2.5-flash-lite"))),
+                max_concurrency=int(os.getenv("LLM_FAST_CONCURRENCY", "16")),
+                input_price=0.10,
+                output_price=0.40
+            ),
+            strong=ModelTier(
+                name="strong",
+                llm=ResilientLLM(self._build_llm(os.getenv("LLM_STRONG_MODEL", "gemini-2.5-flash"))),
+                max_concurrency=int(os.getenv("LLM_STRONG_CONCURRENCY", "8")),
+                input_price=0.30,
+                output_price=2.50
+            )
+        )
+        self.exporter = ChatExporter()
+        self.search = ChatSearch(self.mongo_service)
+        # Counted in the shared state so the limit holds across all workers
+        self.turn_limiter = RateLimiter(
+            self.mongo_service.shared_state,
+            "chat-turns",
+            limit=int(os.getenv("CHAT_TURNS_PER_MINUTE", "0"))
+        )
+        # Variant fan-outs run to completion even if their client disconnects
+        self._background_tasks = set()
         self._register_routes()
     
+    def _build_llm(self, model: str):
+        """Gemini client, with the system prompt served from the provider cache when enabled"""
+        llm = GoogleGenerativeAI(model=model)
+        if not PromptCachingLLM.ENABLED:
+            return llm
+        try:
+            backend = GeminiContextCache(model)
+        except Exception as e:
+            print(f"❌ Prompt caching disabled: {e}")
+            return llm
+        return PromptCachingLLM(llm, backend, state=self.mongo_service.shared_state)
+    
     def _register_routes(self):
         """Register all routes"""
         self.router.post("/login", response_model=TokenResponse)(self.login)
         self.router.get("/chats", response_model=ChatsResponse)(self.get_user_chats)
+        self.router.get("/chats/export")(self.export_chats)
+        self.router.get("/chats/search", response_model=SearchResponse)(self.search_chats)
+        self.router.get("/chats/events")(self.chat_events)
         self.router.get("/chats/{chat_id}/messages")(self.get_chat_messages)
         self.router.post("/chat", response_model=LLMResponse)(self.talk_with_llm)
+        self.router.post("/chat/variants")(self.generate_variants)
+        self.router.get("/chats/{chat_id}/variants", response_model=VariantsResponse)(self.get_chat_variants)
+        self.router.post(
+            "/chats/{chat_id}/sections/{name}/refine",
+            response_model=RefineResponse
+        )(self.refine_section)
         self.router.post("/chats/new", response_model=CreateChatResponse)(self.create_new_chat)
+        self.router.get("/metrics")(self.get_metrics)
+        self.router.websocket("/ws/chats/{chat_id}")(self.chat_websocket)
     
     async def login(self, request: LoginRequest):
         """Authenticate user and return JWT token."""
@@ -61,15 +138,6 @@ class ChatRouter:
         user_id = get_current_user_id(request)
         chats = self.mongo_service.get_user_chats(user_id)
         
-        def get_chat_title(chat):
-            """Extract first human message as title, or return default"""
-            for message in chat.messages:
-                if message.type == "human":
-                    # Truncate long messages for title display
-                    content = message.content.strip()
-                    return content[:50] + "..." if len(content) > 50 else content
-            return "New Chat"
-        
         return ChatsResponse(
             user_id=user_id,
             chat_count=len(chats),
@@ -77,8 +145,8 @@ class ChatRouter:
                 ChatResponse(
                     id=chat.id,
                     last_updated=chat.last_updated,
-                    message_count=len(chat.messages),
-                    title=get_chat_title(chat)
+                    message_count=chat.message_count if chat.archived else len(chat.messages),
+                    title=chat.title if chat.archived else MongoDBService.chat_title(chat.messages)
                 )
                 for chat in chats
             ]
@@ -87,7 +155,7 @@ class ChatRouter:
     async def get_chat_messages(self, request: Request, chat_id: str):
         """Get all messages from a specific chat."""
         user_id = get_current_user_id(request)
-        chat = self.mongo_service.get_chat(chat_id)
+        chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)
         
         if not chat:
             raise HTTPException(
@@ -109,12 +177,166 @@ class ChatRouter:
             ]
         }
     
+    async def export_chats(
+        self,
+        request: Request,
+        format: str = "ndjson",
+        gzip: bool = False,
+        after: Optional[str] = None
+    ):
+        """Stream all chats of the authenticated user as NDJSON or Markdown."""
+        user_id = get_current_user_id(request)
+        
+        if format not in ChatExporter.FORMATS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported format. Use one of: {', '.join(ChatExporter.FORMATS)}"
+            )
+        if after and not ObjectId.is_valid(after):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid resume cursor"
+            )
+        
+        media_type, extension = ChatExporter.FORMATS[format]
+        headers = {"Content-Disposition": f'attachment; filename="chats.{extension}"'}
+        if gzip:
+            headers["Content-Encoding"] = "gzip"
+        
+        chats = self.mongo_service.iter_chats(user_id=user_id, after_id=after)
+        return StreamingResponse(
+            self.exporter.iter_export(chats, format, compress=gzip),
+            media_type=media_type,
+            headers=headers
+        )
+    
+    async def search_chats(
+        self,
+        request: Request,
+        q: str = Query(..., min_length=1, max_length=200),
+        page: int = Query(1, ge=1),
+        page_size: int = Query(20, ge=1, le=50)
+    ):
+        """Search the authenticated user's chat history."""
+        user_id = get_current_user_id(request)
+        results, has_more = self.search.search(user_id, q, page=page, page_size=page_size)
+        
+        return SearchResponse(
+            query=q,
+            page=page,
+            page_size=page_size,
+            has_more=has_more,
+            results=[SearchResult(**result) for result in results]
+        )
+    
+    async def chat_events(self, request: Request):
+        """
+        Server-sent events feed of the user's chat list changes.
+        Authenticates with the Authorization header or, for EventSource
+        clients that cannot set headers, the `token` query parameter.
+        Reconnects resume from the Last-Event-ID header.
+        """
+        auth_header = request.headers.get("Authorization", "")
+        token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else request.query_params.get("token")
+        payload = JWTUtils.verify_token(token) if token else None
+        if not payload:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token"
+            )
+        
+        user_id = payload.get("user_id")
+        last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+        subscription = await self.mongo_service.chat_events.subscribe(user_id, last_event_id)
+        
+        async def stream():
+            try:
+                yield "retry: 3000\n\n"
+                async for event_id, event in subscription.events(heartbeat=15):
+                    if await request.is_disconnected() or payload.get("exp", 0) <= time.time():
+                        return
+                    if event is None:
+                        yield ": keep-alive\n\n"
+                        continue
+                    data = json.dumps({key: value for key, value in event.items() if value is not None and key != "type"})
+                    prefix = f"id: {event_id}\n" if event_id else ""
+                    yield f"{prefix}event: {event['type']}\ndata: {data}\n\n"
+            finally:
+                subscription.close()
+        
+        return StreamingResponse(
+            stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     async def talk_with_llm(self, request: Request, llm_request: LLMRequest):
-        """Send a message to the LLM and get a response."""
+        """
+        Send a message to the LLM and get a response.
+        A retried request carrying the same Idempotency-Key header gets the
+        original response back instead of running the turn again; reusing
+        the key for a different request body is rejected with 422.
+        """
         user_id = get_current_user_id(request)
         
-        if llm_request.chat_id:
-            chat = self.mongo_service.get_chat(llm_request.chat_id)
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if not idempotency_key:
+            self._check_turn_rate(user_id)
+            response, _ = await self._run_turn(user_id, llm_request)
+            return response
+        
+        state = self.mongo_service.shared_state
+        record_key = f"idempotency:chat:{user_id}:{idempotency_key}"
+        body_hash = hashlib.sha256(
+            json.dumps(jsonable_encoder(llm_request), sort_keys=True).encode()
+        ).hexdigest()
+        claimed = state.set_if_absent(
+            record_key,
+            {"status": "in_progress", "body_hash": body_hash},
+            ttl=self.IDEMPOTENCY_LOCK_SECONDS
+        )
+        if not claimed:
+            record = state.get(record_key) or {}
+            if record.get("body_hash", body_hash) != body_hash:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This Idempotency-Key was already used with a different request body"
+                )
+            if record.get("response"):
+                return LLMResponse(**record["response"])
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+        
+        try:
+            self._check_turn_rate(user_id)
+            response, llm_failed = await self._run_turn(user_id, llm_request)
+        except Exception:
+            state.delete(record_key)
+            raise
+        if llm_failed:
+            # The error reply is not the turn's result; let a retry run it again
+            state.delete(record_key)
+        else:
+            state.set(
+                record_key,
+                {"body_hash": body_hash, "response": jsonable_encoder(response)},
+                ttl=self.IDEMPOTENCY_TTL_SECONDS
+            )
+        return response
+    
+    def _check_turn_rate(self, user_id: str, turns: int = 1):
+        if not self.turn_limiter.allow(user_id, turns):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many messages, please slow down"
+            )
+    
+    async def _resolve_chat(self, user_id: str, chat_id: Optional[str]) -> str:
+        """Check access to an existing chat, or create one when no id is given"""
+        if chat_id:
+            chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)
             if not chat:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -125,40 +347,335 @@ class ChatRouter:
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Access denied"
                 )
-            chat_id = llm_request.chat_id
-        else:
-            chat_data = ChatSchema(
-                user_id=user_id,
-                last_updated=datetime.utcnow(),
-                messages=[]
-            )
-            chat = self.mongo_service.create_chat(chat_data)
-            chat_id = chat.id
+            return chat_id
+        chat_data = ChatSchema(
+            user_id=user_id,
+            last_updated=datetime.utcnow(),
+            messages=[]
+        )
+        return self.mongo_service.create_chat(chat_data).id
+    
+    async def _run_turn(self, user_id: str, llm_request: LLMRequest) -> Tuple[LLMResponse, bool]:
+        """
+        Persist the user message, call the LLM and persist its reply.
+        Also returns whether the LLM failed and the reply is an error message.
+        """
+        chat_id = await self._resolve_chat(user_id, llm_request.chat_id)
         
         # Add user message to chat
         user_message = HumanMessage(content=llm_request.message)
-        self.mongo_service.add_message_to_chat(user_id, chat_id, user_message)
+        await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, user_message)
         
         # Reload chat to get all messages including system prompt
-        chat = self.mongo_service.get_chat(chat_id)  
+        chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)  
         
+        llm_failed = False
         try:
-            response = self.llm.invoke(chat.messages)
+            response = await run_in_threadpool(self.llm.invoke, chat.messages, intent=llm_request.intent)
         except Exception as e:
             print(f"❌ LLM invocation error: {e}")
-            response = "Api key quota is finished please wait for the limit to reset"
-
-          
+            response = self._llm_error_message(e)
+            llm_failed = True
+        
         # Save AI response
         ai_message = AIMessage(content=response)
-        self.mongo_service.add_message_to_chat(user_id, chat_id, ai_message)
+        await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, ai_message)
+        self._store_blueprint(chat_id, response)
         
         return LLMResponse(
             chat_id=chat_id,
             user_message=llm_request.message,
             llm_response=response
+        ), llm_failed
+    
+    async def generate_variants(
+        self,
+        request: Request,
+        llm_request: LLMRequest,
+        n: int = Query(3, ge=1, le=MAX_VARIANTS),
+        first: Optional[int] = Query(None, ge=1)
+    ):
+        """
+        Generate n alternative replies to one message concurrently and stream
+        them as NDJSON lines in completion order, returning after the first
+        `first` of them (default: all n). The first reply becomes the chat's
+        answer; the others are kept as sibling variants of the same message.
+        """
+        user_id = get_current_user_id(request)
+        first = min(first or n, n)
+        # Every variant is a model call of its own
+        self._check_turn_rate(user_id, n)
+        chat_id = await self._resolve_chat(user_id, llm_request.chat_id)
+        
+        # The user message is stored and the context built once for all variants
+        user_message = HumanMessage(content=llm_request.message)
+        await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, user_message)
+        chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)
+        messages = chat.messages
+        parent_index = len(messages) - 1
+        
+        lines: asyncio.Queue = asyncio.Queue()
+        
+        async def fan_out():
+            # Each call holds a slot on its model tier, so the fan-out is bounded
+            # by the same per-tier limits as every other turn
+            calls = [
+                asyncio.ensure_future(run_in_threadpool(self.llm.invoke, messages, intent=llm_request.intent))
+                for _ in range(n)
+            ]
+            completed, last_error = [], None
+            try:
+                for call in asyncio.as_completed(calls):
+                    try:
+                        content = await call
+                    except Exception as e:
+                        print(f"❌ LLM invocation error: {e}")
+                        last_error = e
+                        await lines.put({"type": "error", "detail": self._llm_error_message(e)})
+                        continue
+                    await lines.put({"type": "variant", "rank": len(completed), "content": content})
+                    completed.append(content)
+                    if len(completed) >= first:
+                        break
+            finally:
+                # Stop waiting on the rest; calls already running finish in their threads
+                for call in calls:
+                    call.cancel()
+            
+            response = completed[0] if completed else self._llm_error_message(last_error)
+            await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, AIMessage(content=response))
+            self._store_blueprint(chat_id, response)
+            await run_in_threadpool(self.mongo_service.add_variants, user_id, chat_id, parent_index, completed[1:])
+            await lines.put({
+                "type": "done",
+                "chat_id": chat_id,
+                "parent_index": parent_index,
+                "variants": len(completed)
+            })
+        
+        async def run():
+            try:
+                await fan_out()
+            except Exception as e:
+                print(f"❌ Variant generation failed: {e}")
+                await lines.put({"type": "error", "detail": "Variant generation failed"})
+            finally:
+                await lines.put(None)
+        
+        task = asyncio.create_task(run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        
+        async def stream():
+            yield json.dumps({"type": "start", "chat_id": chat_id, "n": n, "first": first}) + "\n"
+            while True:
+                line = await lines.get()
+                if line is None:
+                    return
+                yield json.dumps(line) + "\n"
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    async def get_chat_variants(self, request: Request, chat_id: str, parent_index: Optional[int] = None):
+        """Sibling variants stored for a chat, optionally for one parent message."""
+        user_id = get_current_user_id(request)
+        chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)
+        if not chat:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat not found"
+            )
+        if chat.user_id != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Access denied"
+            )
+        variants = await run_in_threadpool(self.mongo_service.get_variants, chat_id, parent_index)
+        return VariantsResponse(
+            chat_id=chat_id,
+            variants=[ChatVariant(**variant) for variant in variants]
+        )
+    
+    async def chat_websocket(self, websocket: WebSocket, chat_id: str):
+        """
+        Multi-turn chat over one WebSocket connection.
+        The JWT is passed as the `token` query parameter and verified once at
+        connect time; the chat history is loaded once and kept for the life
+        of the connection. Each turn is sent as {"message": "..."} and answered
+        with "chunk" frames followed by a "done" frame. If the stream breaks
+        after some chunks, the turn ends with an "error" frame instead and the
+        partial reply is saved with TRUNCATED_MARKER.
+        """
+        token = websocket.query_params.get("token")
+        payload = JWTUtils.verify_token(token) if token else None
+        if not payload:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or expired token")
+            return
+        
+        user_id = payload.get("user_id")
+        chat = await run_in_threadpool(self.mongo_service.get_chat, chat_id)
+        if not chat or chat.user_id != user_id:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Chat not found")
+            return
+        
+        await websocket.accept()
+        messages = list(chat.messages)
+        
+        try:
+            while True:
+                data = await websocket.receive_json()
+                
+                if payload.get("exp", 0) <= time.time():
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                    return
+                
+                content = str(data.get("message", "")).strip() if isinstance(data, dict) else ""
+                if not content:
+                    await websocket.send_json({"type": "error", "detail": "Message is required"})
+                    continue
+                if not self.turn_limiter.allow(user_id):
+                    await websocket.send_json({"type": "error", "detail": "Too many messages, please slow down"})
+                    continue
+                
+                user_message = HumanMessage(content=content)
+                await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, user_message)
+                messages.append(user_message)
+                
+                chunks = []
+                interrupted = None
+                try:
+                    intent = data.get("intent")
+                    # Closed on every exit so the model tier slot is freed even if the client leaves
+                    with closing(self.llm.stream(messages, intent=intent)) as stream:
+                        async for chunk in iterate_in_threadpool(stream):
+                            chunks.append(chunk)
+                            await websocket.send_json({"type": "chunk", "content": chunk})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    print(f"❌ LLM streaming error: {e}")
+                    if chunks:
+                        interrupted = e
+                    else:
+                        chunks.append(self._llm_error_message(e))
+                        await websocket.send_json({"type": "chunk", "content": chunks[0]})
+                
+                response = "".join(chunks)
+                if interrupted:
+                    response += self.TRUNCATED_MARKER
+                ai_message = AIMessage(content=response)
+                await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, ai_message)
+                messages.append(ai_message)
+                
+                if interrupted:
+                    # A cut-off reply must not replace the stored blueprint
+                    await websocket.send_json({
+                        "type": "error",
+                        "chat_id": chat_id,
+                        "detail": self._llm_error_message(interrupted),
+                        "truncated": True
+                    })
+                    continue
+                self._store_blueprint(chat_id, response)
+                
+                await websocket.send_json({
+                    "type": "done",
+                    "chat_id": chat_id,
+                    "user_message": content,
+                    "llm_response": response
+                })
+        except WebSocketDisconnect:
+            return
+    
+    async def refine_section(self, request: Request, chat_id: str, name: str, refine_request: RefineRequest):
+        """Regenerate one section of the chat's latest blueprint and splice it back in."""
+        user_id = get_current_user_id(request)
+        
+        chat_doc = self.mongo_service.get_blueprint(chat_id)
+        if not chat_doc:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat not found"
+            )
+        if chat_doc["user_id"] != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Access denied"
+            )
+        if not chat_doc.get("blueprint"):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="This chat has no blueprint to refine yet"
+            )
+        
+        blueprint = Blueprint.from_parts(chat_doc["blueprint"]["parts"])
+        if name not in SECTION_LABELS or blueprint.get(name) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Unknown section. Available: {', '.join(blueprint.sections())}"
+            )
+        
+        if chat_doc.get("archived"):
+            # Refinements append to the chat, so bring it back first
+            await run_in_threadpool(self.mongo_service.get_chat, chat_id)
+        
+        self._check_turn_rate(user_id)
+        messages = build_refine_messages(blueprint, name, refine_request.instruction)
+        try:
+            content = await run_in_threadpool(self.llm.invoke, messages, intent="refine", section_only=True)
+        except Exception as e:
+            print(f"❌ LLM invocation error: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=self._llm_error_message(e)
+            )
+        
+        refined = blueprint.replace(name, content)
+        if not self.mongo_service.set_blueprint(chat_id, refined.to_parts(), chat_doc["blueprint"]["updated_at"]):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The blueprint changed while this section was refined, please retry"
+            )
+        
+        # Keep the conversation in step with the refined blueprint
+        user_message = HumanMessage(content=f"Refine {SECTION_LABELS[name]}: {refine_request.instruction}")
+        await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, user_message)
+        ai_message = AIMessage(content=refined.render())
+        await run_in_threadpool(self.mongo_service.add_message_to_chat, user_id, chat_id, ai_message)
+        
+        return RefineResponse(
+            chat_id=chat_id,
+            section=name,
+            content=refined.get(name),
+            blueprint=refined.render()
         )
     
+    def _store_blueprint(self, chat_id: str, response: str):
+        """Keep the latest blueprint of a chat in section-addressable form"""
+        blueprint = Blueprint.parse(response)
+        if blueprint:
+            self.mongo_service.set_blueprint(chat_id, blueprint.to_parts())
+    
+    def _llm_error_message(self, error: Exception) -> str:
+        """Map an LLM failure to the message shown to the user"""
+        if isinstance(error, CircuitOpenError):
+            return "The AI service is temporarily unavailable, please try again in a moment"
+        cause = error.__cause__ if isinstance(error, LLMUnavailableError) and error.__cause__ else error
+        if type(cause).__name__ == "ResourceExhausted" or getattr(cause, "code", None) == 429:
+            return "Api key quota is finished please wait for the limit to reset"
+        return "The AI service is not responding right now, please try again"
+    
+    async def get_metrics(self, request: Request):
+        """Operational metrics for the LLM client and persistence layer."""
+        get_current_user_id(request)
+        return {
+            "worker_pid": os.getpid(),
+            "llm": self.llm.metrics(),
+            "chat_cache": self.mongo_service.chat_cache.metrics(),
+            "write_behind": self.mongo_service.write_behind.metrics(),
+            "chat_events": self.mongo_service.chat_events.metrics()
+        }
+    
     async def create_new_chat(self, request: Request):
         """Create a new empty chat for the authenticated user."""
         user_id = get_current_user_id(request)
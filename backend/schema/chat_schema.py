@@ -2,7 +2,7 @@
 Request/Response schemas for chat routes
 """
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 
@@ -42,6 +42,8 @@ class ChatsResponse(BaseModel):
 class LLMRequest(BaseModel):
     message: str
     chat_id: Optional[str] = None
+    # Optional hint for model routing: "clarify", "blueprint" or "refine"
+    intent: Optional[Literal["clarify", "blueprint", "refine"]] = None
 
 
 class LLMResponse(BaseModel):
@@ -50,6 +52,45 @@ class LLMResponse(BaseModel):
     llm_response: str
 
 
+class RefineRequest(BaseModel):
+    instruction: str
+
+
+class RefineResponse(BaseModel):
+    chat_id: str
+    section: str
+    content: str
+    blueprint: str
+
+
 class CreateChatResponse(BaseModel):
     message: str
     chat_id: str
+
+
+class SearchResult(BaseModel):
+    chat_id: str
+    score: float
+    last_updated: datetime
+    snippet: str
+    highlights: List[List[int]]
+
+
+class SearchResponse(BaseModel):
+    query: str
+    page: int
+    page_size: int
+    has_more: bool
+    results: List[SearchResult]
+
+
+class ChatVariant(BaseModel):
+    parent_index: int
+    rank: int
+    content: str
+    created_at: datetime
+
+
+class VariantsResponse(BaseModel):
+    chat_id: str
+    variants: List[ChatVariant]
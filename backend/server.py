@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -5,6 +7,8 @@ import os
 
 from services.mongodb_service import MongoDBService
 from routes.chat_router import ChatRouter
+from routes.admin_router import AdminRouter
+from services.profiling import TraceRecorder, SlowRequestMiddleware
 from auth.middleware import AuthenticationMiddleware
 
 load_dotenv()
@@ -13,9 +17,25 @@ load_dotenv()
 DEBUG = os.getenv("DEBUG", "true").lower() == "true"
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
+# Worker processes when not in DEBUG; defaults to one per core
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
 
 # Initialize services
 mongo_service = MongoDBService()
+trace_recorder = TraceRecorder()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create indexes and start the chat events watcher on startup, flush queued writes on shutdown"""
+    try:
+        mongo_service.ensure_indexes()
+    except Exception as e:
+        print(f"❌ Failed to create MongoDB indexes: {e}")
+    mongo_service.chat_events.start(asyncio.get_running_loop())
+    yield
+    mongo_service.shutdown()
+
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,6 +44,7 @@ app = FastAPI(
     description="FastAPI backend for LLM chat with MongoDB",
     docs_url="/docs" if DEBUG else None,
     redoc_url="/redoc" if DEBUG else None,
+    lifespan=lifespan,
 )
 
 # CORS configuration for development
@@ -57,14 +78,20 @@ app.add_middleware(
         "/openapi.json",
         "/redoc",
         "/api/login",
+        "/api/chats/events",  # authenticates itself so EventSource can pass ?token=
         "/health",
     ],
     mongo_service=mongo_service
 )
 
+# Trace requests and keep the slow ones (outermost, so auth and CORS are included)
+app.add_middleware(SlowRequestMiddleware, recorder=trace_recorder)
+
 # Initialize and include router
 chat_router = ChatRouter(mongo_service=mongo_service)
 app.include_router(chat_router.router)
+admin_router = AdminRouter(recorder=trace_recorder)
+app.include_router(admin_router.router)
 
 
 @app.get("/")
@@ -80,10 +107,10 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(
-        "server:app",
-        host=HOST,
-        port=PORT,
-        reload=DEBUG,
-        log_level="debug" if DEBUG else "info"
-    )
+    if DEBUG:
+        uvicorn.run("server:app", host=HOST, port=PORT, reload=True, log_level="debug")
+    else:
+        if WORKERS > 1:
+            # Workers inherit the environment; point them all at one state file
+            os.environ.setdefault("SHARED_STATE_URL", "sqlite:///")
+        uvicorn.run("server:app", host=HOST, port=PORT, workers=WORKERS, log_level="info")
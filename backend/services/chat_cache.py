@@ -0,0 +1,191 @@
+"""
+Bounded in-process LRU of recently active chat histories
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from dotenv import load_dotenv
+
+from models.mondb_models import Chat
+
+load_dotenv()
+
+# Rough per-message overhead of a LangChain message object on top of its text
+MESSAGE_OVERHEAD_BYTES = 400
+
+INVALIDATION_CHANNEL = "chat-cache-invalidation"
+
+
+class ChatHistoryCache:
+    """
+    Holds already-built Chat models keyed by chat id, each tagged with the
+    document version it was read at. Entries are only served when the caller
+    confirms the stored version still matches, so a write from another worker
+    is never hidden. Cached Chat objects are shared and must not be mutated.
+
+    With a shared state backend, writes are also announced to the other
+    workers so they drop superseded entries early instead of holding them
+    until their next stale lookup.
+    """
+
+    MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "512"))
+    MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    INVALIDATION_POLL_SECONDS = 0.05
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, state=None):
+        self.max_entries = self.MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+        self.state = state
+        self._entries: "OrderedDict[str, Tuple[int, Chat, int]]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {
+            "hits": 0, "misses": 0, "stale": 0, "evictions": 0, "appends": 0, "remote_invalidations": 0
+        }
+        self._lock = threading.Lock()
+        self._origin = uuid.uuid4().hex
+        self._poll_lock = threading.Lock()
+        self._polled_at = 0.0
+        self._last_message_id = state.latest_id() if state else 0
+
+    @staticmethod
+    def _message_size(message: BaseMessage) -> int:
+        content = message.content
+        size = len(content) if isinstance(content, str) else len(str(content))
+        return size + MESSAGE_OVERHEAD_BYTES
+
+    def _chat_size(self, chat: Chat) -> int:
+        return sum(self._message_size(message) for message in chat.messages)
+
+    def _remove(self, chat_id: str):
+        entry = self._entries.pop(chat_id, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    def _store(self, chat_id: str, version: int, chat: Chat, size: int):
+        self._remove(chat_id)
+        if size > self.max_bytes:
+            return
+        self._entries[chat_id] = (version, chat, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters["evictions"] += 1
+
+    # Cross-worker invalidation
+    def publish_invalidation(self, chat_id: str):
+        """Tell the other workers their entry for this chat is superseded"""
+        if self.state is None:
+            return
+        try:
+            self.state.publish(INVALIDATION_CHANNEL, {"chat_id": chat_id, "origin": self._origin})
+        except Exception as e:
+            print(f"❌ Failed to publish cache invalidation: {e}")
+
+    def _poll_invalidations(self):
+        """Apply invalidations from other workers, at most once per poll interval"""
+        if self.state is None or time.monotonic() - self._polled_at < self.INVALIDATION_POLL_SECONDS:
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._polled_at = time.monotonic()
+            self._last_message_id, messages = self.state.poll(INVALIDATION_CHANNEL, self._last_message_id)
+        except Exception as e:
+            print(f"❌ Failed to poll cache invalidations: {e}")
+            return
+        finally:
+            self._poll_lock.release()
+        with self._lock:
+            for message in messages:
+                if message["origin"] != self._origin and message["chat_id"] in self._entries:
+                    self._remove(message["chat_id"])
+                    self._counters["remote_invalidations"] += 1
+
+    def has(self, chat_id: str) -> bool:
+        """Check for an entry without touching recency; absent ids count as misses"""
+        self._poll_invalidations()
+        with self._lock:
+            if chat_id in self._entries:
+                return True
+            self._counters["misses"] += 1
+            return False
+
+    def get(self, chat_id: str, version: int) -> Optional[Chat]:
+        """Return the cached chat if it was read at exactly this version"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] != version:
+                self._counters["stale"] += 1
+                self._remove(chat_id)
+                return None
+            self._entries.move_to_end(chat_id)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def peek(self, chat_id: str) -> Optional[Chat]:
+        """Return the cached chat without a version check or touching counters"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            return entry[1] if entry else None
+
+    def put(self, chat_id: str, version: int, chat: Chat):
+        with self._lock:
+            self._store(chat_id, version, chat, self._chat_size(chat))
+
+    def append(
+        self,
+        chat_id: str,
+        new_version: Optional[int],
+        message: BaseMessage,
+        last_updated: datetime
+    ):
+        """
+        Write-through for a single appended message. Only applied when the
+        entry sits exactly one version behind; otherwise another writer got
+        in between and the entry is dropped. new_version=None advances the
+        entry by one for writes that are queued but not yet applied.
+        """
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return
+            version, chat, size = entry
+            if new_version is None:
+                new_version = version + 1
+            if version != new_version - 1:
+                self._remove(chat_id)
+                return
+            updated = chat.model_copy(update={
+                "messages": chat.messages + [message],
+                "last_updated": last_updated,
+                "version": new_version,
+            })
+            self._store(chat_id, new_version, updated, size + self._message_size(message))
+            self._counters["appends"] += 1
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._remove(chat_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            lookups = counters["hits"] + counters["misses"] + counters["stale"]
+            counters.update({
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_rate": counters["hits"] / lookups if lookups else None,
+            })
+        return counters
@@ -0,0 +1,338 @@
+"""
+Per-user feed of chat list changes, pushed from one watcher per worker
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from pymongo.errors import OperationFailure, PyMongoError
+
+load_dotenv()
+
+EVENTS_CHANNEL = "chat-events"
+
+# Only inserts and writes that touch last_updated change what the chat list shows
+CHANGE_STREAM_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace"]}},
+        {"updateDescription.updatedFields.last_updated": {"$exists": True}},
+    ]}},
+    {"$project": {
+        "operationType": 1,
+        "documentKey": 1,
+        "user_id": "$fullDocument.user_id",
+        "last_updated": "$fullDocument.last_updated",
+        "message_count": {"$cond": [
+            {"$isArray": "$fullDocument.messages"},
+            {"$size": "$fullDocument.messages"},
+            "$fullDocument.message_count",
+        ]},
+        # The first message after the system prompt is what the title is built from
+        "title_messages": {"$cond": [
+            {"$isArray": "$fullDocument.messages"},
+            {"$slice": ["$fullDocument.messages", 1, 1]},
+            {"$literal": []},
+        ]},
+        "title": "$fullDocument.title",
+    }},
+]
+
+
+class Subscription:
+    """One connected client; events arrive on an asyncio queue"""
+
+    def __init__(self, hub: "ChatEventHub", user_id: str, queue_size: int):
+        self.hub = hub
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Tuple[str, dict]]" = asyncio.Queue(queue_size)
+        self.overflowed = False
+        # Event ids already delivered by catch-up, skipped when they arrive live
+        self.seen: Set[str] = set()
+
+    def offer(self, event_id: str, event: dict):
+        if self.overflowed:
+            return
+        if event_id in self.seen:
+            self.seen.discard(event_id)
+            return
+        try:
+            self.queue.put_nowait((event_id, event))
+        except asyncio.QueueFull:
+            # A client this far behind re-fetches the list instead
+            self.overflowed = True
+            self.hub._counters["resets"] += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((self.hub.position_id(), {"type": "reset"}))
+
+    async def events(self, heartbeat: float) -> AsyncIterator[Tuple[Optional[str], Optional[dict]]]:
+        """Yield (event_id, event); (None, None) every heartbeat seconds of silence"""
+        while True:
+            try:
+                event_id, event = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None, None
+                continue
+            if event["type"] == "reset":
+                self.overflowed = False
+            yield event_id, event
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+
+class ChatEventHub:
+    """
+    Watches the chats collection once per worker and fans compact delta
+    events out to the subscribed connections of each user.
+
+    Sources:
+        change_stream - a MongoDB change stream (replica sets and sharded
+                        clusters); event ids are change stream resume tokens
+        local         - MongoDBService publishes events on the shared state
+                        backend; event ids are "l<message id>"
+
+    A client reconnecting with Last-Event-ID gets the events it missed, from
+    the in-memory replay ring, a resumed change stream or the shared channel.
+    When that is no longer possible it gets a "reset" event and should
+    re-fetch GET /api/chats once.
+    """
+
+    SOURCE = os.getenv("CHAT_EVENTS_SOURCE", "auto").lower()
+    REPLAY_EVENTS = int(os.getenv("CHAT_EVENTS_REPLAY", "1000"))
+    QUEUE_SIZE = 256
+    POLL_INTERVAL_SECONDS = 0.1
+    # Longest catch-up served on resume before falling back to a reset
+    MAX_CATCH_UP_EVENTS = 200
+
+    def __init__(self, chats_collection, state, title_of: Callable[[List[dict]], str], source: Optional[str] = None):
+        self.chats_collection = chats_collection
+        self.state = state
+        self.title_of = title_of
+        self._source = (source or self.SOURCE).lower()
+        self._mode: Optional[str] = None
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._replay: "deque[Tuple[str, str, dict]]" = deque(maxlen=self.REPLAY_EVENTS)
+        self._replay_index: Dict[str, int] = {}
+        self._replayed = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._resume_token: Optional[dict] = None
+        self._counters = {"events": 0, "delivered": 0, "resets": 0, "resumes": 0, "watcher_errors": 0}
+
+    # Mode
+    @property
+    def mode(self) -> str:
+        if self._mode is None:
+            self._mode = self._detect_mode()
+        return self._mode
+
+    def _detect_mode(self) -> str:
+        if self._source in ("change_stream", "local"):
+            return self._source
+        try:
+            hello = self.chats_collection.database.client.admin.command("hello")
+        except PyMongoError:
+            return "local"
+        supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return "change_stream" if supported else "local"
+
+    # Lifecycle
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start the watcher thread; events are dispatched on the given loop"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._loop = loop
+        self._stopping.clear()
+        target = self._watch_change_stream if self.mode == "change_stream" else self._poll_local
+        self._thread = threading.Thread(target=target, name="chat-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    # Producer side
+    def publish_local(self, user_id: str, event: dict):
+        """Announce a chat list change when no change stream is watching"""
+        if self.mode != "local":
+            return
+        try:
+            self.state.publish(EVENTS_CHANNEL, {"user_id": user_id, "event": event})
+        except Exception as e:
+            print(f"❌ Failed to publish chat event: {e}")
+
+    def _event_from_change(self, change: dict) -> Tuple[str, str, dict]:
+        title = change.get("title")
+        if title is None and change.get("title_messages") is not None:
+            title = self.title_of(change["title_messages"])
+        last_updated = change.get("last_updated")
+        event = {
+            "type": "chat.created" if change["operationType"] == "insert" else "chat.updated",
+            "chat_id": str(change["documentKey"]["_id"]),
+            "last_updated": last_updated.isoformat() if isinstance(last_updated, datetime) else last_updated,
+            "message_count": change.get("message_count"),
+            "title": title,
+        }
+        return change["_id"]["_data"], change.get("user_id"), event
+
+    def _watch_change_stream(self):
+        while not self._stopping.is_set():
+            try:
+                with self.chats_collection.watch(
+                    CHANGE_STREAM_PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                    max_await_time_ms=1000
+                ) as stream:
+                    while not self._stopping.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        self._resume_token = change["_id"]
+                        event_id, user_id, event = self._event_from_change(change)
+                        if user_id:
+                            self._loop.call_soon_threadsafe(self._dispatch, event_id, user_id, event)
+            except OperationFailure as e:
+                print(f"❌ Chat event change stream failed, restarting from now: {e}")
+                self._counters["watcher_errors"] += 1
+                self._resume_token = None
+                time.sleep(1)
+            except PyMongoError as e:
+                print(f"❌ Chat event change stream interrupted, resuming: {e}")
+                self._counters["watcher_errors"] += 1
+                time.sleep(1)
+
+    def _poll_local(self):
+        since_id = self.state.latest_id()
+        while not self._stopping.wait(self.POLL_INTERVAL_SECONDS):
+            try:
+                messages = self.state.read(EVENTS_CHANNEL, since_id)
+            except Exception as e:
+                print(f"❌ Failed to poll chat events: {e}")
+                self._counters["watcher_errors"] += 1
+                continue
+            for message_id, message in messages:
+                since_id = message_id
+                self._loop.call_soon_threadsafe(
+                    self._dispatch, f"l{message_id}", message["user_id"], message["event"]
+                )
+
+    # Fan-out (runs on the event loop)
+    def _dispatch(self, event_id: str, user_id: str, event: dict):
+        self._counters["events"] += 1
+        if len(self._replay) == self._replay.maxlen:
+            oldest = self._replay[0][0]
+            self._replay_index.pop(oldest, None)
+            self._replayed += 1
+        self._replay.append((event_id, user_id, event))
+        self._replay_index[event_id] = self._replayed + len(self._replay) - 1
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.offer(event_id, event)
+            self._counters["delivered"] += 1
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    async def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> Subscription:
+        """
+        Register a connection for a user's events. With last_event_id the
+        missed events are queued first; registration happens before the
+        catch-up so nothing falls into the gap, and duplicates are skipped.
+        """
+        subscription = Subscription(self, user_id, self.QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        if not last_event_id:
+            return subscription
+
+        self._counters["resumes"] += 1
+        missed = self._from_replay(user_id, last_event_id)
+        if missed is None:
+            missed = await asyncio.get_running_loop().run_in_executor(
+                None, self._catch_up, user_id, last_event_id
+            )
+        if missed is None:
+            self._counters["resets"] += 1
+            missed = [(self.position_id(), {"type": "reset"})]
+        # Live events that arrived during the catch-up go after the missed ones
+        pending = []
+        while not subscription.queue.empty():
+            pending.append(subscription.queue.get_nowait())
+        for event_id, event in missed:
+            subscription.offer(event_id, event)
+        subscription.seen = {event_id for event_id, _ in missed}
+        for event_id, event in pending:
+            subscription.offer(event_id, event)
+        return subscription
+
+    def position_id(self) -> str:
+        """Event id of the current position, so a reset can be resumed from"""
+        if self.mode == "local":
+            return f"l{self.state.latest_id()}"
+        return self._resume_token["_data"] if self._resume_token else ""
+
+    def _from_replay(self, user_id: str, last_event_id: str) -> Optional[List[Tuple[str, dict]]]:
+        position = self._replay_index.get(last_event_id)
+        if position is None:
+            return None
+        return [
+            (event_id, event)
+            for event_id, event_user, event in list(self._replay)[position - self._replayed + 1:]
+            if event_user == user_id
+        ]
+
+    def _catch_up(self, user_id: str, last_event_id: str) -> Optional[List[Tuple[str, dict]]]:
+        """Events for this user after last_event_id from the source itself (blocking)"""
+        missed = []
+        if last_event_id.startswith("l") != (self.mode == "local"):
+            # Issued while the feed ran from the other source
+            return None
+        try:
+            if self.mode == "local":
+                since_id = int(last_event_id[1:])
+                oldest_id = self.state.oldest_id()
+                if oldest_id is not None and oldest_id > since_id + 1:
+                    # Messages after since_id may already have been purged
+                    return None
+                for message_id, message in self.state.read(EVENTS_CHANNEL, since_id):
+                    if message["user_id"] == user_id:
+                        missed.append((f"l{message_id}", message["event"]))
+                return missed
+            pipeline = CHANGE_STREAM_PIPELINE + [{"$match": {"user_id": user_id}}]
+            with self.chats_collection.watch(
+                pipeline,
+                full_document="updateLookup",
+                resume_after={"_data": last_event_id},
+                max_await_time_ms=200
+            ) as stream:
+                while len(missed) <= self.MAX_CATCH_UP_EVENTS:
+                    change = stream.try_next()
+                    if change is None:
+                        return missed
+                    event_id, _, event = self._event_from_change(change)
+                    missed.append((event_id, event))
+        except (ValueError, PyMongoError):
+            return None
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        counters = dict(self._counters)
+        counters.update({
+            "mode": self._mode,
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "users": len(self._subscribers),
+            "replay_events": len(self._replay),
+        })
+        return counters
@@ -0,0 +1,83 @@
+"""
+Streaming chat export to NDJSON and Markdown
+"""
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from models.mondb_models import Chat
+
+
+class ChatExporter:
+    """Renders chats one at a time so exports run in constant memory"""
+
+    FORMATS = {
+        "ndjson": ("application/x-ndjson", "ndjson"),
+        "markdown": ("text/markdown; charset=utf-8", "md"),
+    }
+
+    def __init__(self, include_system: bool = False):
+        self.include_system = include_system
+
+    def _messages(self, chat: Chat):
+        for message in chat.messages:
+            if message.type == "system" and not self.include_system:
+                continue
+            yield message
+
+    def render_ndjson(self, chat: Chat) -> str:
+        """One JSON line per chat; `cursor` can be passed back to resume"""
+        record = {
+            "id": chat.id,
+            "user_id": chat.user_id,
+            "last_updated": chat.last_updated.isoformat(),
+            "messages": [
+                {"type": message.type, "content": message.content}
+                for message in self._messages(chat)
+            ],
+            "cursor": chat.id,
+        }
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def render_markdown(self, chat: Chat) -> str:
+        """One Markdown section per chat, tagged with its resume cursor"""
+        lines = [
+            f"## Chat {chat.id}",
+            "",
+            f"_Last updated: {chat.last_updated.isoformat()}_",
+            f"<!-- cursor: {chat.id} -->",
+            "",
+        ]
+        for message in self._messages(chat):
+            lines.append(f"### {message.type.capitalize()}")
+            lines.append("")
+            lines.append(str(message.content).strip())
+            lines.append("")
+        lines.append("---")
+        lines.append("")
+        return "\n".join(lines) + "\n"
+
+    def iter_export(self, chats: Iterable[Chat], fmt: str, compress: bool = False) -> Iterator[bytes]:
+        """
+        Yield the export body chunk by chunk. With compress=True the output is
+        a single gzip stream, flushed after every chat so bytes reach the
+        client as soon as each chat is rendered.
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        render = self.render_ndjson if fmt == "ndjson" else self.render_markdown
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+        if fmt == "markdown":
+            header = "# Chat Export\n\n".encode("utf-8")
+            yield compressor.compress(header) if compressor else header
+
+        for chat in chats:
+            data = render(chat).encode("utf-8")
+            if compressor:
+                yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                yield data
+
+        if compressor:
+            yield compressor.flush()
@@ -0,0 +1,66 @@
+"""
+Fault-injecting fake LLM for exercising the LLM wrappers offline
+"""
+import random
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+
+class FakeLLMError(Exception):
+    """Transient error raised by FakeLLM, looks like a provider 503"""
+    code = 503
+
+
+class FakeLLM:
+    """
+    Drop-in stand-in for GoogleGenerativeAI exposing invoke() and stream().
+    Latency, failures and hangs are injected with the given probabilities.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[Sequence[str]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        hang_seconds: float = 60.0,
+        error_factory: Callable[[], Exception] = FakeLLMError,
+        seed: Optional[int] = None,
+    ):
+        self.responses = list(responses or ["Fake response"])
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.error_factory = error_factory
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _next_response(self) -> str:
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        time.sleep(delay)
+        if roll < self.hang_rate:
+            time.sleep(self.hang_seconds)
+        elif roll < self.hang_rate + self.failure_rate:
+            raise self.error_factory()
+        return self.responses[index % len(self.responses)]
+
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> str:
+        """Return the next canned response, subject to injected faults"""
+        return self._next_response()
+
+    def stream(self, messages: List[BaseMessage], **kwargs) -> Iterator[str]:
+        """Yield the next canned response word by word"""
+        words = self._next_response().split(" ")
+        for index, word in enumerate(words):
+            yield word if index == len(words) - 1 else word + " "
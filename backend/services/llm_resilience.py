@@ -0,0 +1,362 @@
+"""
+Resilience wrapper around the LLM client: deadlines, retries, circuit breaking and hedging
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.messages import BaseMessage
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class LLMError(Exception):
+    """Base class for errors raised by the resilience layer"""
+
+
+class LLMTimeoutError(LLMError):
+    """The LLM call did not finish within its deadline"""
+
+
+class CircuitOpenError(LLMError):
+    """The circuit breaker is open and the call was rejected without trying"""
+
+
+class LLMUnavailableError(LLMError):
+    """All attempts failed; the last error is chained as __cause__"""
+
+
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "TooManyRequests",
+    "BadGateway",
+    "GatewayTimeout",
+}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Check whether an LLM error is transient and worth retrying"""
+    if isinstance(exc, (LLMTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if type(exc).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    return getattr(exc, "code", None) in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+    Opens after `failure_threshold` consecutive failures and lets a single
+    probe through once `reset_timeout` seconds have passed. Only transient
+    failures are recorded; a rejected request says nothing about the
+    provider's health.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may be attempted right now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self):
+        """End a call that neither succeeded nor failed transiently; frees the probe slot"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of overall traffic so a provider outage
+    does not turn into a retry storm. Every call deposits `ratio` tokens,
+    every retry withdraws one.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class ResilientLLM:
+    """
+    Wraps any object exposing invoke()/stream() (GoogleGenerativeAI, FakeLLM)
+    with a per-attempt deadline, jittered exponential backoff on retryable
+    errors, a circuit breaker and optional hedged requests.
+
+    Python threads cannot be killed, so an attempt that times out keeps
+    running in the worker pool; its result is simply discarded.
+    """
+
+    TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+    MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    HEDGE_ENABLED = os.getenv("LLM_HEDGE", "false").lower() == "true"
+
+    def __init__(
+        self,
+        llm,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: Optional[bool] = None,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        retryable: Callable[[BaseException], bool] = is_retryable_error,
+        max_workers: int = 32,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.llm = llm
+        self.timeout = self.TIMEOUT_SECONDS if timeout is None else timeout
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = self.HEDGE_ENABLED if hedge is None else hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.retryable = retryable
+        self.sleep = sleep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._latencies = deque(maxlen=500)
+        self._counters = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "attempts": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "hedges_sent": 0,
+            "hedges_won": 0,
+            "circuit_rejections": 0,
+            "budget_exhausted": 0,
+        }
+        self._lock = threading.Lock()
+
+    # Metrics
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _percentile(self, quantile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(quantile * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before sending a hedged request, None until enough samples exist"""
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+        return self._percentile(self.hedge_quantile)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of counters, latency percentiles and breaker state"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters.update({
+            "latency_p50": self._percentile(0.5),
+            "latency_p95": self._percentile(0.95),
+            "circuit_state": self.breaker.state,
+        })
+        if hasattr(self.llm, "metrics"):
+            counters["client"] = self.llm.metrics()
+        return counters
+
+    # Calls
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given retry number"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _attempt(self, messages: List[BaseMessage], kwargs: dict) -> Any:
+        """Run one attempt, with an optional hedge, under the deadline"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        pending = {self._executor.submit(self.llm.invoke, messages, **kwargs)}
+        primary = next(iter(pending))
+
+        delay = self.hedge_delay() if self.hedge else None
+        if delay is not None and delay < self.timeout:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                pending.add(self._executor.submit(self.llm.invoke, messages, **kwargs))
+                self._count("hedges_sent")
+
+        error: Optional[BaseException] = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedges_won")
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+
+        if pending:
+            self._count("timeouts")
+            raise LLMTimeoutError(f"LLM call exceeded {self.timeout:.1f}s deadline")
+        raise error
+
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> Any:
+        """Invoke the wrapped LLM with deadlines, retries and circuit breaking"""
+        self._count("calls")
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("circuit_rejections")
+                raise CircuitOpenError("LLM circuit breaker is open")
+
+            self._count("attempts")
+            try:
+                result = self._attempt(messages, kwargs)
+            except Exception as e:
+                retryable = self.retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                if not retryable or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise LLMUnavailableError(str(e)) from e
+                if not self.retry_budget.withdraw():
+                    self._count("budget_exhausted")
+                    self._count("failures")
+                    raise LLMUnavailableError(str(e)) from e
+                self._count("retries")
+                self.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            self._count("successes")
+            return result
+
+    def stream(self, messages: List[BaseMessage], **kwargs) -> Iterator[Any]:
+        """
+        Stream from the wrapped LLM. Each chunk gets its own deadline; errors
+        are retried only until the first chunk has been yielded.
+        """
+        self._count("calls")
+        self.retry_budget.deposit()
+        sentinel = object()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("circuit_rejections")
+                raise CircuitOpenError("LLM circuit breaker is open")
+
+            self._count("attempts")
+            started = time.monotonic()
+            yielded = False
+            settled = False
+            try:
+                iterator = self._executor.submit(self.llm.stream, messages, **kwargs).result(timeout=self.timeout)
+                while True:
+                    future: Future = self._executor.submit(next, iterator, sentinel)
+                    try:
+                        chunk = future.result(timeout=self.timeout)
+                    except TimeoutError:
+                        self._count("timeouts")
+                        raise LLMTimeoutError(f"LLM stream stalled for {self.timeout:.1f}s")
+                    if chunk is sentinel:
+                        break
+                    if not yielded:
+                        with self._lock:
+                            self._latencies.append(time.monotonic() - started)
+                    yielded = True
+                    yield chunk
+                self.breaker.record_success()
+                settled = True
+            except Exception as e:
+                settled = True
+                retryable = self.retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                if yielded or not retryable or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise LLMUnavailableError(str(e)) from e
+                if not self.retry_budget.withdraw():
+                    self._count("budget_exhausted")
+                    self._count("failures")
+                    raise LLMUnavailableError(str(e)) from e
+                self._count("retries")
+                self.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            finally:
+                if not settled:
+                    # The consumer closed the stream early (GeneratorExit)
+                    self.breaker.release()
+
+            self._count("successes")
+            return
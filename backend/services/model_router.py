@@ -0,0 +1,294 @@
+"""
+Per-turn routing between a fast model tier and a strong model tier
+"""
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from dotenv import load_dotenv
+
+from services.blueprint_sections import Blueprint
+from services.llm_resilience import LLMError, LLMUnavailableError, CircuitOpenError, is_retryable_error
+from services.profiling import record_span
+from services.prompt_cache import estimate_tokens
+
+load_dotenv()
+
+BLUEPRINT_MARKERS = ("[THE MASTER PROMPT]", "[UPGRADE SUMMARY]")
+
+
+class TierSaturatedError(LLMError):
+    """No concurrency slot became free on the chosen tier in time"""
+
+
+@dataclass
+class ModelTier:
+    """One model with its concurrency limit and per-million-token prices (USD)"""
+    name: str
+    llm: Any
+    max_concurrency: int = 8
+    input_price: float = 0.0
+    output_price: float = 0.0
+    slots: threading.BoundedSemaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+
+@dataclass
+class TurnFeatures:
+    message_length: int
+    turn_index: int
+    has_blueprint: bool
+    intent: Optional[str]
+    # Set by the section refine endpoint, never from a client-supplied intent
+    section_only: bool = False
+
+
+class TieredModelRouter:
+    """
+    Picks a tier per turn from cheap features of the conversation, holds a
+    concurrency slot on that tier for the call, and escalates a fast-tier
+    reply to the strong tier when the fast call fails or its reply fails
+    structural validation (empty, a broken blueprint, or a whole blueprint
+    where the section refine endpoint asked for one section).
+
+    Intents: "clarify" and "refine" prefer the fast tier, "blueprint" forces
+    the strong tier; without one the features decide.
+    """
+
+    ENABLED = os.getenv("LLM_ROUTING_ENABLED", "true").lower() == "true"
+    SHORT_MESSAGE_CHARS = int(os.getenv("LLM_ROUTING_SHORT_MESSAGE_CHARS", "280"))
+    LONG_MESSAGE_CHARS = int(os.getenv("LLM_ROUTING_LONG_MESSAGE_CHARS", "1500"))
+    # Messages this short on a fresh chat are too vague for a blueprint
+    VAGUE_MESSAGE_CHARS = 40
+    SLOT_TIMEOUT_SECONDS = float(os.getenv("LLM_SLOT_TIMEOUT_SECONDS", "30"))
+
+    def __init__(self, fast: ModelTier, strong: ModelTier, enabled: Optional[bool] = None):
+        self.fast = fast
+        self.strong = strong
+        self.enabled = self.ENABLED if enabled is None else enabled
+        self._decisions = deque(maxlen=100)
+        self._stats = {
+            tier.name: {"calls": 0, "latency_total": 0.0, "cost": 0.0, "strong_equivalent_cost": 0.0}
+            for tier in (fast, strong)
+        }
+        self._counters = {"escalations": 0, "spillovers": 0}
+        self._lock = threading.Lock()
+
+    # Routing
+    @staticmethod
+    def features(messages: List[BaseMessage], intent: Optional[str] = None, section_only: bool = False) -> TurnFeatures:
+        human = [message for message in messages if message.type == "human"]
+        last = human[-1].content if human else ""
+        has_blueprint = any(
+            message.type == "ai" and isinstance(message.content, str)
+            and BLUEPRINT_MARKERS[0] in message.content
+            for message in messages
+        )
+        return TurnFeatures(
+            message_length=len(last) if isinstance(last, str) else 0,
+            turn_index=max(0, len(human) - 1),
+            has_blueprint=has_blueprint,
+            intent=intent,
+            section_only=section_only,
+        )
+
+    def choose(self, features: TurnFeatures) -> Tuple[ModelTier, str]:
+        """Return the tier for this turn and the reason it was picked"""
+        if not self.enabled:
+            return self.strong, "routing disabled"
+        if features.intent == "blueprint":
+            return self.strong, "blueprint intent"
+        if features.intent in ("clarify", "refine"):
+            return self.fast, f"{features.intent} intent"
+        if features.message_length >= self.LONG_MESSAGE_CHARS:
+            return self.strong, "long message"
+        if not features.has_blueprint:
+            if features.message_length < self.VAGUE_MESSAGE_CHARS:
+                return self.fast, "vague opener needs clarification"
+            return self.strong, "first blueprint"
+        if features.message_length < self.SHORT_MESSAGE_CHARS:
+            return self.fast, "short follow-up"
+        return self.strong, "default"
+
+    @staticmethod
+    def needs_escalation(output: Any, features: TurnFeatures) -> bool:
+        """Structural validation of a fast-tier reply"""
+        if not isinstance(output, str) or not output.strip():
+            return True
+        attempted_blueprint = any(marker in output for marker in BLUEPRINT_MARKERS)
+        if features.section_only:
+            return attempted_blueprint
+        return attempted_blueprint and Blueprint.parse(output) is None
+
+    # Calls
+    def _acquire(self, tier: ModelTier) -> ModelTier:
+        """Take a slot; a saturated fast tier spills over to a free strong slot"""
+        if tier is self.fast:
+            if tier.slots.acquire(blocking=False):
+                return tier
+            if self.strong.slots.acquire(blocking=False):
+                with self._lock:
+                    self._counters["spillovers"] += 1
+                return self.strong
+        if not tier.slots.acquire(timeout=self.SLOT_TIMEOUT_SECONDS):
+            raise TierSaturatedError(f"No free slot on the {tier.name} model tier")
+        return tier
+
+    def _record(self, tier: ModelTier, messages: List[BaseMessage], output: str, latency: float):
+        input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        output_tokens = estimate_tokens(output if isinstance(output, str) else "")
+        with self._lock:
+            stats = self._stats[tier.name]
+            stats["calls"] += 1
+            stats["latency_total"] += latency
+            stats["cost"] += tier.cost(input_tokens, output_tokens)
+            stats["strong_equivalent_cost"] += self.strong.cost(input_tokens, output_tokens)
+
+    @staticmethod
+    def escalates_on(error: BaseException) -> bool:
+        """Capacity and transient failures are worth a strong-tier try; rejected requests are not"""
+        if isinstance(error, (TierSaturatedError, CircuitOpenError)):
+            return True
+        cause = error.__cause__ if isinstance(error, LLMUnavailableError) and error.__cause__ else error
+        return is_retryable_error(cause)
+
+    def _call(self, tier: ModelTier, messages: List[BaseMessage], kwargs: dict) -> Tuple[ModelTier, str, float]:
+        waited = time.perf_counter()
+        tier = self._acquire(tier)
+        started = time.perf_counter()
+        record_span("llm.slot_wait", waited, started, tier=tier.name)
+        try:
+            output = tier.llm.invoke(messages, **kwargs)
+        except LLMError as e:
+            # Tells the caller which tier failed after a spillover
+            e.tier = tier
+            raise
+        finally:
+            tier.slots.release()
+            record_span("llm", started, tier=tier.name)
+        latency = time.perf_counter() - started
+        self._record(tier, messages, output, latency)
+        return tier, output, latency
+
+    def _decide(self, features: TurnFeatures, chosen: ModelTier, served: Optional[ModelTier], reason: str,
+                escalated: bool, outcome: str, latency: float):
+        self._decisions.append({
+            "at": time.time(),
+            "features": features.__dict__,
+            "chosen": chosen.name,
+            "served_by": served.name if served else None,
+            "reason": reason,
+            "escalated": escalated,
+            "outcome": outcome,
+            "latency": round(latency, 3),
+        })
+
+    def invoke(
+        self,
+        messages: List[BaseMessage],
+        intent: Optional[str] = None,
+        section_only: bool = False,
+        **kwargs
+    ) -> str:
+        """section_only: the caller asked for one blueprint section, not a whole blueprint"""
+        features = self.features(messages, intent, section_only)
+        chosen, reason = self.choose(features)
+        started = time.perf_counter()
+        served, escalated, outcome = None, False, "failed"
+        try:
+            try:
+                served, output, _ = self._call(chosen, messages, kwargs)
+                failed = served is self.fast and self.needs_escalation(output, features)
+            except LLMError as e:
+                served = getattr(e, "tier", None)
+                if chosen is not self.fast or served is self.strong or not self.escalates_on(e):
+                    raise
+                print(f"❌ Fast model tier failed, escalating: {e}")
+                failed = True
+
+            if failed:
+                escalated = True
+                with self._lock:
+                    self._counters["escalations"] += 1
+                served, output, _ = self._call(self.strong, messages, kwargs)
+            outcome = "completed"
+            return output
+        finally:
+            self._decide(features, chosen, served, reason, escalated, outcome, time.perf_counter() - started)
+
+    def stream(self, messages: List[BaseMessage], intent: Optional[str] = None, **kwargs) -> Iterator[str]:
+        """
+        Stream from the chosen tier. A fast-tier failure before the first
+        chunk escalates to the strong tier; once chunks are out it cannot.
+        Callers that stop reading early should close() the generator
+        (contextlib.closing) so the tier slot is released at once.
+        """
+        features = self.features(messages, intent)
+        chosen, reason = self.choose(features)
+        started = time.perf_counter()
+        tier, served, escalated, outcome = chosen, None, False, "abandoned"
+        chunks = []
+        try:
+            while True:
+                attempt = None
+                try:
+                    attempt = self._acquire(tier)
+                    served = attempt
+                    attempt_started = time.perf_counter()
+                    parts = attempt.llm.stream(messages, **kwargs)
+                    try:
+                        for chunk in parts:
+                            chunks.append(chunk)
+                            yield chunk
+                    finally:
+                        if hasattr(parts, "close"):
+                            parts.close()
+                    outcome = "completed"
+                    return
+                except LLMError as e:
+                    if chunks or attempt is self.strong or tier is self.strong or not self.escalates_on(e):
+                        outcome = "failed"
+                        raise
+                    print(f"❌ Fast model tier failed, escalating: {e}")
+                finally:
+                    if attempt is not None:
+                        attempt.slots.release()
+                        record_span("llm.stream", attempt_started, tier=attempt.name, chunks=len(chunks))
+                escalated = True
+                with self._lock:
+                    self._counters["escalations"] += 1
+                tier = self.strong
+        finally:
+            latency = time.perf_counter() - started
+            if served is not None and chunks:
+                self._record(served, messages, "".join(str(chunk) for chunk in chunks), latency)
+            self._decide(features, chosen, served, reason, escalated, outcome, latency)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier in (self.fast, self.strong):
+                stats = dict(self._stats[tier.name])
+                stats["avg_latency"] = stats["latency_total"] / stats["calls"] if stats["calls"] else None
+                stats["model"] = tier.llm.metrics() if hasattr(tier.llm, "metrics") else None
+                tiers[tier.name] = stats
+            total_cost = sum(stats["cost"] for stats in tiers.values())
+            strong_cost = sum(stats["strong_equivalent_cost"] for stats in tiers.values())
+            return {
+                "enabled": self.enabled,
+                "tiers": tiers,
+                "escalations": self._counters["escalations"],
+                "spillovers": self._counters["spillovers"],
+                "estimated_cost": round(total_cost, 6),
+                "estimated_savings": round(strong_cost - total_cost, 6),
+                "recent_decisions": list(self._decisions)[-20:],
+            }
@@ -1,19 +1,42 @@
 import os
-from typing import List, Optional
-from datetime import datetime
+import re
+import json
+import time
+import zlib
+from typing import Iterator, List, Optional
+from datetime import datetime, timedelta
 from langchain_mongodb import MongoDBChatMessageHistory
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage, message_to_dict
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, TEXT, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import bson
+from bson import ObjectId, Binary
 
 from models.mondb_models import User, Chat
 from schema.mondb_schema import UserSchema, ChatSchema
+from services.chat_cache import ChatHistoryCache
+from services.chat_events import ChatEventHub
+from services.profiling import MongoTraceListener, record_span
+from services.shared_state import create_state_backend
+from services.write_behind import WriteBehindQueue, DUPLICATE_KEY_ERROR
 
 # Load environment variables
 load_dotenv()
 
+
+class DuplicateUserError(ValueError):
+    """Raised when creating a user whose username is already taken"""
+
+
 class MongoDBService:
+    # Message bodies at least this many bytes are stored zlib-compressed
+    COMPRESSION_THRESHOLD = int(os.getenv("MESSAGE_COMPRESSION_THRESHOLD", "1024"))
+    # Chats untouched for this many days are moved to the archive collection
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    # Fields that grow with the chat but are never part of a Chat model
+    CHAT_READ_PROJECTION = {"search_terms": 0, "blueprint": 0}
+    
     MASTERPROMPT = """
 
         ### ROLE
@@ -61,13 +84,51 @@ class MongoDBService:
 
         """
     
-    def __init__(self):
+    def __init__(self, shared_state=None):
         self.mongodb_uri = os.getenv("MONGODB_URI")
         self.db_name = "stunning_task"
-        self.client = MongoClient(self.mongodb_uri)
+        # Commands issued during a traced request show up in its slow-request trace
+        self.client = MongoClient(self.mongodb_uri, event_listeners=[MongoTraceListener()])
         self.db = self.client[self.db_name]
         self.users_collection = self.db["users"]
         self.chats_collection = self.db["chats"]
+        self.archive_collection = self.db["chats_archive"]
+        # Alternative AI replies, pointing at the message they answer instead of copying the history
+        self.variants_collection = self.db["chat_variants"]
+        # State shared with the other worker processes (see services/shared_state.py)
+        self.shared_state = shared_state or create_state_backend()
+        self.chat_cache = ChatHistoryCache(state=self.shared_state)
+        self.write_behind = WriteBehindQueue(
+            self.chats_collection,
+            self.db["langchain_chat_history"],
+            state=self.shared_state
+        )
+        self.chat_events = ChatEventHub(
+            self.chats_collection,
+            self.shared_state,
+            title_of=lambda stored: self.chat_title([self._dict_to_message(msg) for msg in stored])
+        )
+    
+    def shutdown(self):
+        """Flush queued writes and close the client"""
+        self.chat_events.stop()
+        self.write_behind.stop()
+        self.client.close()
+    
+    def ensure_indexes(self):
+        """Create the indexes the service relies on (idempotent)"""
+        # Prefixed text index: queries must pin user_id, so a search only
+        # touches that user's index entries and stays flat as history grows
+        self.chats_collection.create_index(
+            [("user_id", ASCENDING), ("search_terms", TEXT)],
+            name="chat_search"
+        )
+        self.chats_collection.create_index([("last_updated", ASCENDING)], name="chat_last_updated")
+        self.users_collection.create_index([("username", ASCENDING)], name="user_username", unique=True)
+        self.variants_collection.create_index(
+            [("chat_id", ASCENDING), ("parent_index", ASCENDING), ("rank", ASCENDING)],
+            name="chat_variants_parent"
+        )
     
     # User operations
     def create_user(self, user_data: UserSchema) -> User:
@@ -80,10 +141,36 @@ class MongoDBService:
         
         # Store as hashed_password in DB
         user_dict["hashed_password"] = user_dict.pop("password")
-        result = self.users_collection.insert_one(user_dict)
+        if self.users_collection.find_one({"username": user_dict["username"]}, {"_id": 1}):
+            raise DuplicateUserError(f"Username '{user_dict['username']}' already exists")
+        try:
+            result = self.users_collection.insert_one(user_dict)
+        except DuplicateKeyError:
+            raise DuplicateUserError(f"Username '{user_dict['username']}' already exists")
         user_dict["id"] = str(result.inserted_id)
         return User(**user_dict)
     
+    def insert_users(self, user_docs: List[dict]) -> dict:
+        """
+        Insert already-hashed user documents with one unordered insert_many.
+        Duplicates are reported instead of aborting the batch.
+        """
+        report = {"inserted": 0, "duplicates": [], "errors": []}
+        if not user_docs:
+            return report
+        try:
+            result = self.users_collection.insert_many(user_docs, ordered=False)
+            report["inserted"] = len(result.inserted_ids)
+        except BulkWriteError as e:
+            report["inserted"] = e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                username = user_docs[error["index"]]["username"]
+                if error["code"] == DUPLICATE_KEY_ERROR:
+                    report["duplicates"].append(username)
+                else:
+                    report["errors"].append({"username": username, "error": error.get("errmsg", "")})
+        return report
+    
     def get_user(self, user_id: str) -> Optional[User]:
         """Get user by ID"""
         user_doc = self.users_collection.find_one({"_id": ObjectId(user_id)})
@@ -118,33 +205,79 @@ class MongoDBService:
         
         # Convert BaseMessage objects to dict for MongoDB storage
         chat_dict["messages"] = [self._message_to_dict(msg) for msg in messages]
+        chat_dict["version"] = 0
         result = self.chats_collection.insert_one(chat_dict)
         chat_dict["id"] = str(result.inserted_id)
         # Convert back to BaseMessage objects
         chat_dict["messages"] = [self._dict_to_message(msg) for msg in chat_dict["messages"]]
-        return Chat(**chat_dict)
+        chat = Chat(**chat_dict)
+        self.chat_cache.put(chat.id, chat.version, chat)
+        self._publish_chat_event("chat.created", chat.user_id, chat.id, chat.last_updated)
+        return chat
     
     def get_chat(self, chat_id: str) -> Optional[Chat]:
-        """Get chat by ID"""
-        chat_doc = self.chats_collection.find_one({"_id": ObjectId(chat_id)})
+        """
+        Get chat by ID. Recently active chats are served from the in-process
+        cache after a cheap version probe instead of a full read and decode.
+        With write-behind on this may wait for other workers' queued appends
+        or flush this worker's, so async callers run it in the threadpool.
+        """
+        if self.write_behind.enabled and not self.write_behind.wait_for_other_workers(chat_id):
+            print(f"❌ Appends queued by another worker for chat {chat_id} are still pending")
+        
+        if self.chat_cache.has(chat_id):
+            # Queued write-behind appends are already in the cached entry
+            pending = self.write_behind.pending_count(chat_id)
+            version_doc = self.chats_collection.find_one({"_id": ObjectId(chat_id)}, {"version": 1})
+            if not version_doc:
+                self.chat_cache.invalidate(chat_id)
+                return None
+            cached = self.chat_cache.get(chat_id, version_doc.get("version", 0) + pending)
+            if cached:
+                return cached
+        
+        if self.write_behind.pending_count(chat_id):
+            self.write_behind.flush()
+        
+        chat_doc = self.chats_collection.find_one({"_id": ObjectId(chat_id)}, self.CHAT_READ_PROJECTION)
+        if chat_doc and chat_doc.get("archived"):
+            chat_doc = self._rehydrate_chat(chat_doc)
         if chat_doc:
-            chat_doc["id"] = str(chat_doc["_id"])
-            del chat_doc["_id"]
-            # Convert message dicts back to BaseMessage objects
-            chat_doc["messages"] = [self._dict_to_message(msg) for msg in chat_doc["messages"]]
-            return Chat(**chat_doc)
+            chat = self._doc_to_chat(chat_doc)
+            self.chat_cache.put(chat_id, chat.version, chat)
+            return chat
         return None
     
     def get_user_chats(self, user_id: str) -> List[Chat]:
         """Get all chats for a user"""
-        chat_docs = self.chats_collection.find({"user_id": user_id})
-        chats = []
-        for chat_doc in chat_docs:
-            chat_doc["id"] = str(chat_doc["_id"])
-            del chat_doc["_id"]
-            chat_doc["messages"] = [self._dict_to_message(msg) for msg in chat_doc["messages"]]
-            chats.append(Chat(**chat_doc))
-        return chats
+        chat_docs = self.chats_collection.find({"user_id": user_id}, self.CHAT_READ_PROJECTION)
+        return [self._doc_to_chat(chat_doc) for chat_doc in chat_docs]
+    
+    def iter_chats(
+        self,
+        user_id: Optional[str] = None,
+        after_id: Optional[str] = None,
+        batch_size: int = 50
+    ) -> Iterator[Chat]:
+        """
+        Stream chats one at a time from a cursor ordered by id, so memory stays
+        constant regardless of history size. Pass the last seen chat id as
+        after_id to resume. Without user_id every chat is returned.
+        """
+        query = {}
+        if user_id is not None:
+            query["user_id"] = user_id
+        if after_id:
+            query["_id"] = {"$gt": ObjectId(after_id)}
+        
+        cursor = self.chats_collection.find(query, self.CHAT_READ_PROJECTION).sort("_id", 1).batch_size(batch_size)
+        try:
+            for chat_doc in cursor:
+                if chat_doc.get("archived"):
+                    chat_doc["messages"] = self._archived_messages(chat_doc["_id"])
+                yield self._doc_to_chat(chat_doc)
+        finally:
+            cursor.close()
     
     def get_chat_history(self, user_id: str, chat_id: str) -> MongoDBChatMessageHistory:
         """Get LangChain MongoDBChatMessageHistory for a specific chat"""
@@ -158,6 +291,33 @@ class MongoDBService:
     
     def add_message_to_chat(self, user_id: str, chat_id: str, message: BaseMessage):
         """Add a message to both our chat model and LangChain history"""
+        now = datetime.utcnow()
+        update = {
+            "$push": {"messages": self._message_to_dict(message)},
+            "$set": {"last_updated": now},
+            "$inc": {"version": 1}
+        }
+        search_terms = self._search_terms(message)
+        if search_terms:
+            update["$addToSet"] = {"search_terms": {"$each": search_terms}}
+        
+        if self.write_behind.enabled:
+            # Queue both writes for the next group commit; the cache entry is
+            # advanced now so this worker keeps reading its own writes
+            history_doc = {
+                "SessionId": f"{user_id}_{chat_id}",
+                "History": json.dumps(message_to_dict(message))
+            }
+            self.chat_cache.append(chat_id, None, message, now)
+            try:
+                self.write_behind.submit(chat_id, update, history_doc)
+            except Exception:
+                self.chat_cache.invalidate(chat_id)
+                raise
+            self.chat_cache.publish_invalidation(chat_id)
+            self._publish_chat_event("chat.updated", user_id, chat_id, now)
+            return
+        
         # Add to LangChain history
         history = self.get_chat_history(user_id, chat_id)
         if isinstance(message, HumanMessage):
@@ -168,58 +328,379 @@ class MongoDBService:
             history.add_message(message)
         
         # Update our chat model
-        self.chats_collection.update_one(
+        result = self.chats_collection.find_one_and_update(
             {"_id": ObjectId(chat_id)},
-            {
-                "$push": {"messages": self._message_to_dict(message)},
-                "$set": {"last_updated": datetime.utcnow()}
-            }
+            update,
+            projection={"version": 1, "last_updated": 1},
+            return_document=ReturnDocument.AFTER
         )
+        if result:
+            self.chat_cache.append(chat_id, result["version"], message, result["last_updated"])
+            self.chat_cache.publish_invalidation(chat_id)
+            self._publish_chat_event("chat.updated", user_id, chat_id, result["last_updated"])
     
     def sync_chat_with_langchain(self, user_id: str, chat_id: str):
         """Sync our chat model with LangChain history"""
         history = self.get_chat_history(user_id, chat_id)
         messages = [self._message_to_dict(msg) for msg in history.messages]
+        now = datetime.utcnow()
         
         self.chats_collection.update_one(
             {"_id": ObjectId(chat_id)},
             {
                 "$set": {
                     "messages": messages,
-                    "last_updated": datetime.utcnow()
-                }
+                    "last_updated": now
+                },
+                "$inc": {"version": 1}
             }
         )
+        self.chat_cache.invalidate(chat_id)
+        self.chat_cache.publish_invalidation(chat_id)
+        self._publish_chat_event("chat.updated", user_id, chat_id, now, history.messages)
     
-    def _message_to_dict(self, message: BaseMessage) -> dict:
-        """Convert BaseMessage to dict for MongoDB storage"""
-        return {
-            "type": message.type,
-            "content": message.content,
-            "additional_kwargs": getattr(message, 'additional_kwargs', {}),
-            "response_metadata": getattr(message, 'response_metadata', {})
+    def _publish_chat_event(
+        self,
+        event_type: str,
+        user_id: str,
+        chat_id: str,
+        last_updated: datetime,
+        messages: Optional[List[BaseMessage]] = None
+    ):
+        """Chat list delta for the events feed when no change stream is watching"""
+        if self.chat_events.mode != "local":
+            return
+        if messages is None:
+            # Title and count come from the write-through cache entry when there is one
+            chat = self.chat_cache.peek(chat_id)
+            messages = chat.messages if chat else None
+        self.chat_events.publish_local(user_id, {
+            "type": event_type,
+            "chat_id": chat_id,
+            "last_updated": last_updated.isoformat(),
+            "message_count": len(messages) if messages is not None else None,
+            "title": self.chat_title(messages) if messages is not None else None,
+        })
+    
+    # Blueprint operations
+    def set_blueprint(self, chat_id: str, parts: List[dict], expected_updated_at: Optional[datetime] = None) -> bool:
+        """
+        Store the latest blueprint of a chat as addressable parts. With
+        expected_updated_at the write only applies if the stored blueprint is
+        still the one that was read; returns False when it changed meanwhile.
+        """
+        query = {"_id": ObjectId(chat_id)}
+        if expected_updated_at is not None:
+            query["blueprint.updated_at"] = expected_updated_at
+        result = self.chats_collection.update_one(
+            query,
+            {"$set": {"blueprint": {"parts": parts, "updated_at": datetime.utcnow()}}}
+        )
+        return result.matched_count == 1
+    
+    def get_blueprint(self, chat_id: str) -> Optional[dict]:
+        """
+        Owner and stored blueprint of a chat, without reading its messages.
+        An archived chat is left archived; the caller rehydrates it with
+        get_chat once it has checked the owner.
+        """
+        chat_doc = self.chats_collection.find_one(
+            {"_id": ObjectId(chat_id)},
+            {"user_id": 1, "blueprint": 1, "archived": 1}
+        )
+        if chat_doc and chat_doc.get("archived"):
+            payload = self._archive_payload(chat_doc["_id"])
+            if payload and payload.get("blueprint"):
+                chat_doc["blueprint"] = payload["blueprint"]
+        return chat_doc
+    
+    # Variant operations
+    def add_variants(self, user_id: str, chat_id: str, parent_index: int, variants: List[str], first_rank: int = 1):
+        """
+        Store sibling AI replies to the message at parent_index. The reply
+        kept in the conversation is rank 0; siblings are numbered from first_rank.
+        """
+        if not variants:
+            return
+        now = datetime.utcnow()
+        self.variants_collection.insert_many([
+            {
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "parent_index": parent_index,
+                "rank": first_rank + offset,
+                "message": self._message_to_dict(AIMessage(content=content)),
+                "created_at": now
+            }
+            for offset, content in enumerate(variants)
+        ], ordered=False)
+    
+    def get_variants(self, chat_id: str, parent_index: Optional[int] = None) -> List[dict]:
+        """Stored sibling replies of a chat, optionally for one parent message"""
+        query = {"chat_id": chat_id}
+        if parent_index is not None:
+            query["parent_index"] = parent_index
+        cursor = self.variants_collection.find(query).sort([("parent_index", ASCENDING), ("rank", ASCENDING)])
+        return [
+            {
+                "parent_index": doc["parent_index"],
+                "rank": doc["rank"],
+                "content": self._dict_to_message(doc["message"]).content,
+                "created_at": doc["created_at"]
+            }
+            for doc in cursor
+        ]
+    
+    # Archive operations
+    def archive_inactive_chats(
+        self,
+        older_than: Optional[timedelta] = None,
+        batch_size: int = 100,
+        dry_run: bool = False
+    ) -> dict:
+        """
+        Move chats whose last_updated is older than the threshold into the
+        archive collection as one compressed payload with the messages and
+        blueprint, leaving a stub with the fields the chat list and search
+        need. Returns a report of bytes moved.
+        """
+        older_than = older_than or timedelta(days=self.ARCHIVE_AFTER_DAYS)
+        cutoff = datetime.utcnow() - older_than
+        report = {
+            "cutoff": cutoff,
+            "chats_archived": 0,
+            "chats_skipped": 0,
+            "primary_bytes_before": 0,
+            "primary_bytes_after": 0,
+            "archive_bytes": 0,
         }
+        
+        cursor = self.chats_collection.find(
+            {"last_updated": {"$lt": cutoff}, "archived": {"$ne": True}}
+        ).batch_size(batch_size)
+        for chat_doc in cursor:
+            messages = chat_doc.get("messages", [])
+            stub_fields = {
+                "archived": True,
+                "message_count": len(messages),
+                "title": self.chat_title([self._dict_to_message(msg) for msg in messages]),
+            }
+            payload = {"messages": messages}
+            if chat_doc.get("blueprint"):
+                payload["blueprint"] = chat_doc["blueprint"]
+            archive_doc = {
+                "_id": chat_doc["_id"],
+                "user_id": chat_doc["user_id"],
+                "payload": Binary(zlib.compress(bson.encode(payload), 9)),
+                "archived_at": datetime.utcnow(),
+            }
+            # search_terms stay so archived chats remain searchable
+            stub = {
+                key: value for key, value in chat_doc.items()
+                if key not in ("messages", "applied_writes", "blueprint")
+            }
+            stub.update(stub_fields)
+            
+            before = len(bson.encode(chat_doc))
+            after = len(bson.encode(stub))
+            archive_bytes = len(bson.encode(archive_doc))
+            
+            if not dry_run:
+                self.archive_collection.replace_one({"_id": chat_doc["_id"]}, archive_doc, upsert=True)
+                # Guard on version so a chat written to meanwhile is left alone
+                result = self.chats_collection.update_one(
+                    {"_id": chat_doc["_id"], "version": chat_doc.get("version")},
+                    {
+                        "$set": stub_fields,
+                        "$unset": {"messages": "", "applied_writes": "", "blueprint": ""},
+                        "$inc": {"version": 1}
+                    }
+                )
+                if result.modified_count == 0:
+                    self.archive_collection.delete_one({"_id": chat_doc["_id"]})
+                    report["chats_skipped"] += 1
+                    continue
+                self.chat_cache.invalidate(str(chat_doc["_id"]))
+                self.chat_cache.publish_invalidation(str(chat_doc["_id"]))
+            
+            report["chats_archived"] += 1
+            report["primary_bytes_before"] += before
+            report["primary_bytes_after"] += after
+            report["archive_bytes"] += archive_bytes
+        
+        report["bytes_moved"] = report["primary_bytes_before"] - report["primary_bytes_after"]
+        collection_bytes = self.db.command("collStats", self.chats_collection.name).get("size", 0)
+        if not dry_run:
+            collection_bytes += report["bytes_moved"]
+        report["collection_bytes_before"] = collection_bytes
+        report["collection_bytes_after"] = collection_bytes - report["bytes_moved"]
+        report["working_set_reduction"] = (
+            report["bytes_moved"] / collection_bytes if collection_bytes else 0.0
+        )
+        return report
+    
+    def _archive_payload(self, chat_id: ObjectId) -> Optional[dict]:
+        """Decompressed messages and blueprint of an archived chat"""
+        archive_doc = self.archive_collection.find_one({"_id": chat_id})
+        if not archive_doc:
+            return None
+        return bson.decode(zlib.decompress(bytes(archive_doc["payload"])))
+    
+    def _archived_messages(self, chat_id: ObjectId) -> List[dict]:
+        """Stored message dicts of an archived chat, without rehydrating it"""
+        payload = self._archive_payload(chat_id)
+        return payload["messages"] if payload else []
+    
+    def _rehydrate_chat(self, chat_doc: dict) -> Optional[dict]:
+        """Move an archived chat back into the primary collection on access"""
+        archive_doc = self.archive_collection.find_one({"_id": chat_doc["_id"]})
+        if not archive_doc:
+            # Another worker rehydrated it between our two reads
+            return self.chats_collection.find_one({"_id": chat_doc["_id"]}, self.CHAT_READ_PROJECTION)
+        
+        payload = bson.decode(zlib.decompress(bytes(archive_doc["payload"])))
+        restored = {"messages": payload["messages"]}
+        if payload.get("blueprint"):
+            restored["blueprint"] = payload["blueprint"]
+        self.chats_collection.update_one(
+            {"_id": chat_doc["_id"], "archived": True},
+            {
+                "$set": restored,
+                "$unset": {"archived": "", "message_count": "", "title": ""}
+            }
+        )
+        self.archive_collection.delete_one({"_id": chat_doc["_id"]})
+        
+        for key in ("archived", "message_count", "title"):
+            chat_doc.pop(key, None)
+        chat_doc["messages"] = restored["messages"]
+        return chat_doc
+    
+    @staticmethod
+    def chat_title(messages: List[BaseMessage]) -> str:
+        """Extract first human message as title, or return default"""
+        for message in messages:
+            if message.type == "human":
+                # Truncate long messages for title display
+                content = message.content.strip()
+                return content[:50] + "..." if len(content) > 50 else content
+        return "New Chat"
+    
+    # Search operations
+    def search_user_chats(self, user_id: str, query: str, skip: int = 0, limit: int = 20) -> List[dict]:
+        """
+        Ranked full-text search over a user's chats.
+        Returns raw documents with id, score, last_updated and messages.
+        Scores ignore term frequency since search_terms holds each term once.
+        """
+        cursor = self.chats_collection.find(
+            {"user_id": user_id, "$text": {"$search": query}},
+            {"score": {"$meta": "textScore"}, "last_updated": 1, "messages": 1, "archived": 1}
+        ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(limit)
+        results = []
+        for chat_doc in cursor:
+            if chat_doc.get("archived"):
+                chat_doc["messages"] = self._archived_messages(chat_doc["_id"])
+            chat_doc["id"] = str(chat_doc.pop("_id"))
+            chat_doc["messages"] = [self._dict_to_message(msg) for msg in chat_doc.get("messages", [])]
+            results.append(chat_doc)
+        return results
+    
+    def backfill_search_terms(self, batch_size: int = 100) -> int:
+        """Populate search_terms for chats written before search existed"""
+        updated = 0
+        cursor = self.chats_collection.find(
+            {"search_terms": {"$exists": False}},
+            {"messages": 1}
+        ).batch_size(batch_size)
+        for chat_doc in cursor:
+            terms = set()
+            for msg in chat_doc.get("messages", []):
+                terms.update(self._search_terms(self._dict_to_message(msg)))
+            self.chats_collection.update_one(
+                {"_id": chat_doc["_id"]},
+                {"$set": {"search_terms": sorted(terms)}}
+            )
+            updated += 1
+        return updated
+    
+    def _search_terms(self, message: BaseMessage) -> List[str]:
+        """
+        Distinct lowercase terms of a human/AI message for the search index.
+        Terms are stored once per chat, so $text scoring ranks by which query
+        terms a chat contains, not by how often they occur in it.
+        """
+        if message.type not in ("human", "ai") or not isinstance(message.content, str):
+            return []
+        return sorted(set(re.findall(r"[a-z0-9][a-z0-9'-]{1,39}", message.content.lower())))
+    
+    def _doc_to_chat(self, chat_doc: dict) -> Chat:
+        """Convert a raw chat document into a Chat model"""
+        started = time.perf_counter()
+        chat_doc["id"] = str(chat_doc["_id"])
+        del chat_doc["_id"]
+        # Convert message dicts back to BaseMessage objects
+        chat_doc["messages"] = [self._dict_to_message(msg) for msg in chat_doc.get("messages", [])]
+        chat = Chat(**chat_doc)
+        record_span("mongo.decode", started, messages=len(chat.messages))
+        return chat
+    
+    def _message_to_dict(self, message: BaseMessage) -> dict:
+        """
+        Convert BaseMessage to a compact dict for MongoDB storage.
+        Short keys, empty kwargs/metadata omitted, and bodies above
+        COMPRESSION_THRESHOLD bytes zlib-compressed into a Binary.
+        """
+        message_dict = {"t": message.type, "c": message.content}
+        
+        if isinstance(message.content, str):
+            encoded = message.content.encode("utf-8")
+            if len(encoded) >= self.COMPRESSION_THRESHOLD:
+                compressed = zlib.compress(encoded, 6)
+                if len(compressed) < len(encoded):
+                    message_dict["c"] = Binary(compressed)
+                    message_dict["z"] = "zlib"
+        
+        additional_kwargs = getattr(message, 'additional_kwargs', None)
+        if additional_kwargs:
+            message_dict["k"] = additional_kwargs
+        response_metadata = getattr(message, 'response_metadata', None)
+        if response_metadata:
+            message_dict["m"] = response_metadata
+        return message_dict
     
     def _dict_to_message(self, message_dict: dict) -> BaseMessage:
-        """Convert dict back to BaseMessage"""
-        if message_dict["type"] == "human":
+        """Convert dict back to BaseMessage (compact and legacy layouts)"""
+        if "t" in message_dict:
+            message_type = message_dict["t"]
+            content = message_dict["c"]
+            if message_dict.get("z") == "zlib":
+                content = zlib.decompress(bytes(content)).decode("utf-8")
+            additional_kwargs = message_dict.get("k", {})
+            response_metadata = message_dict.get("m", {})
+        else:
+            message_type = message_dict["type"]
+            content = message_dict["content"]
+            additional_kwargs = message_dict.get("additional_kwargs", {})
+            response_metadata = message_dict.get("response_metadata", {})
+        
+        if message_type == "human":
             return HumanMessage(
-                content=message_dict["content"],
-                additional_kwargs=message_dict.get("additional_kwargs", {}),
-                response_metadata=message_dict.get("response_metadata", {})
+                content=content,
+                additional_kwargs=additional_kwargs,
+                response_metadata=response_metadata
             )
-        elif message_dict["type"] == "ai":
+        elif message_type == "ai":
             return AIMessage(
-                content=message_dict["content"],
-                additional_kwargs=message_dict.get("additional_kwargs", {}),
-                response_metadata=message_dict.get("response_metadata", {})
+                content=content,
+                additional_kwargs=additional_kwargs,
+                response_metadata=response_metadata
             )
-        elif message_dict["type"] == "system":
+        elif message_type == "system":
             # For other message types, create a generic BaseMessage
             return SystemMessage(
-                content=message_dict["content"],
-                type=message_dict["type"],
-                additional_kwargs=message_dict.get("additional_kwargs", {}),
-                response_metadata=message_dict.get("response_metadata", {})
+                content=content,
+                type=message_type,
+                additional_kwargs=additional_kwargs,
+                response_metadata=response_metadata
             )
-
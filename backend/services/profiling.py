@@ -0,0 +1,416 @@
+"""
+Runtime profiling: a stack-sampling profiler and per-request traces of slow requests
+"""
+import asyncio
+import functools
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import bson
+from dotenv import load_dotenv
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+load_dotenv()
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampler over every thread of the worker. A background thread
+    reads sys._current_frames() at a fixed interval and counts each stack,
+    so the cost is one stack walk per thread per interval and nothing is
+    added to the code being profiled. Output is in the collapsed format
+    read by flamegraph.pl and speedscope.
+    """
+
+    # Leaf frames of threads that are parked rather than doing work
+    IDLE_FRAMES = {
+        ("threading.py", "wait"),
+        ("threading.py", "_wait_for_tstate_lock"),
+        ("selectors.py", "select"),
+        ("queue.py", "get"),
+        ("thread.py", "_worker"),
+        ("base_events.py", "_run_once"),
+    }
+    MAX_DEPTH = 64
+    MAX_STACKS = 20000
+    MAX_DURATION_SECONDS = 300
+
+    def __init__(self):
+        self.interval = 0.01
+        self.running = False
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._samples: Counter = Counter()
+        self._sample_count = 0
+        self._dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, interval: float = 0.01, duration: Optional[float] = None) -> bool:
+        """Start sampling; stops by itself after duration seconds (capped)"""
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = max(0.001, interval)
+            self.running = True
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._samples = Counter()
+            self._sample_count = 0
+            self._dropped = 0
+            self._stop.clear()
+            duration = min(duration or self.MAX_DURATION_SECONDS, self.MAX_DURATION_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(duration,), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(5)
+
+    def _run(self, duration: float):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                self._record(names.get(ident, str(ident)), frame)
+            self._sample_count += 1
+        with self._lock:
+            self.running = False
+            self.stopped_at = time.time()
+
+    def _record(self, thread_name: str, frame):
+        stack = []
+        while frame is not None and len(stack) < self.MAX_DEPTH:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        if not stack:
+            return
+        idle = stack[0] in self.IDLE_FRAMES
+        key = (thread_name, idle, tuple(reversed(stack)))
+        with self._lock:
+            if key not in self._samples and len(self._samples) >= self.MAX_STACKS:
+                self._dropped += 1
+                return
+            self._samples[key] += 1
+
+    def collapsed(self, include_idle: bool = False) -> str:
+        """One "thread;file:function;... count" line per distinct stack"""
+        with self._lock:
+            samples = list(self._samples.items())
+        lines = []
+        for (thread_name, idle, stack), count in samples:
+            if idle and not include_idle:
+                continue
+            frames = ";".join(f"{filename}:{function}" for filename, function in stack)
+            lines.append(f"{thread_name};{frames} {count}")
+        lines.sort()
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            busy = sum(count for (_, idle, _), count in self._samples.items() if not idle)
+            return {
+                "running": self.running,
+                "interval_ms": self.interval * 1000,
+                "started_at": self.started_at,
+                "stopped_at": self.stopped_at,
+                "samples": self._sample_count,
+                "busy_stack_samples": busy,
+                "distinct_stacks": len(self._samples),
+                "dropped_stacks": self._dropped,
+            }
+
+
+class RequestTrace:
+    """Timed spans of one request, relative to when it started"""
+
+    MAX_SPANS = 500
+
+    def __init__(self, trace_id: int, method: str, path: str):
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.spans: List[dict] = []
+        self.dropped_spans = 0
+        self.endpoint_ended: Optional[float] = None
+        self.mongo_commands: Dict[int, Any] = {}
+        # (span, command, reply) whose sizes are measured only if the trace is kept
+        self.unsized: List[tuple] = []
+
+    def add_span(self, name: str, started: float, ended: float, **attrs) -> Optional[dict]:
+        """started/ended are time.perf_counter() values"""
+        if len(self.spans) >= self.MAX_SPANS:
+            self.dropped_spans += 1
+            return None
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round((ended - started) * 1000, 3),
+        }
+        span.update(attrs)
+        self.spans.append(span)
+        return span
+
+    def measure_sizes(self):
+        """BSON sizes of the commands and replies recorded by MongoTraceListener"""
+        for span, command, reply in self.unsized:
+            try:
+                if command is not None:
+                    span["request_bytes"] = len(bson.encode(command))
+                if reply is not None:
+                    span["reply_bytes"] = len(bson.encode(reply))
+            except Exception:
+                continue
+        self.unsized = []
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 3)
+
+    def summary(self) -> Dict[str, dict]:
+        """Totals per span name: count, time, documents and (when measured) bytes"""
+        totals: Dict[str, dict] = {}
+        for span in self.spans:
+            total = totals.setdefault(span["name"], {"count": 0, "duration_ms": 0.0, "documents": 0, "bytes": 0})
+            total["count"] += 1
+            total["duration_ms"] = round(total["duration_ms"] + span["duration_ms"], 3)
+            total["documents"] += span.get("documents", 0)
+            total["bytes"] += span.get("request_bytes", 0) + span.get("reply_bytes", 0)
+        return totals
+
+    def to_dict(self, spans: bool = True) -> Dict[str, Any]:
+        result = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "summary": self.summary(),
+        }
+        if spans:
+            result["spans"] = self.spans
+            result["dropped_spans"] = self.dropped_spans
+        return result
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_span(name: str, started: float, ended: Optional[float] = None, **attrs):
+    """Add a span to the request being traced, if any (perf_counter times)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, ended if ended is not None else time.perf_counter(), **attrs)
+
+
+class TraceRecorder:
+    """
+    Traces every HTTP request and keeps the ones slower than the threshold
+    in a bounded ring buffer. Streaming endpoints are skipped since they are
+    slow by design.
+    """
+
+    SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+    CAPACITY = int(os.getenv("SLOW_REQUEST_TRACES", "100"))
+    EXCLUDED_PREFIXES = ("/api/chats/events", "/api/chats/export", "/api/chat/variants", "/api/admin/")
+
+    def __init__(self, threshold_ms: Optional[float] = None, capacity: Optional[int] = None):
+        self.threshold_ms = self.SLOW_REQUEST_MS if threshold_ms is None else threshold_ms
+        self._traces: "deque[RequestTrace]" = deque(maxlen=capacity or self.CAPACITY)
+        self._ids = itertools.count(1)
+        self._counters = {"traced": 0, "captured": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def should_trace(self, path: str) -> bool:
+        return self.enabled and not path.startswith(self.EXCLUDED_PREFIXES)
+
+    def new_trace(self, method: str, path: str) -> RequestTrace:
+        return RequestTrace(next(self._ids), method, path)
+
+    def offer(self, trace: RequestTrace):
+        captured = trace.duration_ms >= self.threshold_ms
+        if captured:
+            # Runs after the response has been sent, and only for kept traces
+            trace.measure_sizes()
+        else:
+            trace.unsized = []
+        with self._lock:
+            self._counters["traced"] += 1
+            if captured:
+                self._traces.append(trace)
+                self._counters["captured"] += 1
+
+    def traces(self, limit: int = 20) -> List[RequestTrace]:
+        """Most recent captured traces first"""
+        with self._lock:
+            return list(reversed(self._traces))[:limit]
+
+    def get(self, trace_id: int) -> Optional[RequestTrace]:
+        with self._lock:
+            return next((trace for trace in self._traces if trace.id == trace_id), None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            counters.update({"threshold_ms": self.threshold_ms, "buffered": len(self._traces)})
+        return counters
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware that runs each HTTP request under a RequestTrace"""
+
+    def __init__(self, app, recorder: TraceRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.recorder.should_trace(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        trace = self.recorder.new_trace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_trace.reset(token)
+            trace.finish()
+            if trace.unsized and trace.duration_ms >= self.recorder.threshold_ms:
+                # Sizing re-encodes the replies, so keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.recorder.offer, trace)
+            else:
+                self.recorder.offer(trace)
+
+
+class MongoTraceListener(monitoring.CommandListener):
+    """
+    Records every MongoDB command issued while a request is traced, with its
+    server round-trip time and the number of documents returned or written.
+    Request/reply sizes are measured by re-encoding the command and reply,
+    which is deferred until the request has finished and only done for
+    traces that are kept; TRACE_MONGO_BYTES=false skips it. Commands
+    outside a traced request cost one context variable lookup.
+    """
+
+    MEASURE_BYTES = os.getenv("TRACE_MONGO_BYTES", "true").lower() == "true"
+
+    def __init__(self, measure_bytes: Optional[bool] = None):
+        self.measure_bytes = self.MEASURE_BYTES if measure_bytes is None else measure_bytes
+
+    @staticmethod
+    def _documents(reply) -> Optional[int]:
+        """Documents in a cursor batch, or written, without re-encoding the reply"""
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+            if isinstance(batch, list):
+                return len(batch)
+        n = reply.get("n")
+        return n if isinstance(n, int) else None
+
+    def started(self, event):
+        trace = _current_trace.get()
+        if trace is not None and self.measure_bytes:
+            trace.mongo_commands[event.request_id] = event.command
+
+    def succeeded(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        ended = time.perf_counter()
+        attrs = {}
+        documents = self._documents(event.reply) if isinstance(event.reply, dict) else None
+        if documents is not None:
+            attrs["documents"] = documents
+        span = trace.add_span(f"mongo.{event.command_name}", ended - event.duration_micros / 1_000_000, ended, **attrs)
+        command = trace.mongo_commands.pop(event.request_id, None)
+        if span is not None and self.measure_bytes:
+            trace.unsized.append((span, command, event.reply))
+
+    def failed(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        ended = time.perf_counter()
+        trace.mongo_commands.pop(event.request_id, None)
+        trace.add_span(
+            f"mongo.{event.command_name}",
+            ended - event.duration_micros / 1_000_000,
+            ended,
+            error=str(event.failure.get("errmsg", "")) if isinstance(event.failure, dict) else str(event.failure)
+        )
+
+
+def _timed_endpoint(endpoint):
+    """Wrap an async endpoint so its own run time is recorded apart from serialization"""
+    if not inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.endpoint_ended = time.perf_counter()
+                trace.add_span("endpoint", started, trace.endpoint_ended)
+
+    return wrapper
+
+
+class TracedRoute(APIRoute):
+    """
+    APIRoute that splits a traced request into the endpoint itself and the
+    response validation and serialization FastAPI does after it returns.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def traced_handler(request):
+            response = await handler(request)
+            trace = _current_trace.get()
+            if trace is not None and trace.endpoint_ended is not None:
+                trace.add_span("serialize", trace.endpoint_ended, time.perf_counter())
+                trace.endpoint_ended = None
+            return response
+
+        return traced_handler
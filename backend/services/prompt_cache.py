@@ -0,0 +1,389 @@
+"""
+Provider-side caching of the system prompt prefix for LLM calls
+"""
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token) when usage is not reported"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def is_context_missing(exc: BaseException) -> bool:
+    """Check whether a generate error means the cached context is gone or expired"""
+    if isinstance(exc, LookupError):
+        return True
+    if type(exc).__name__ in ("NotFound", "PermissionDenied"):
+        return True
+    return getattr(exc, "code", None) in (403, 404)
+
+
+@dataclass
+class CachedContext:
+    """A registered system prompt on the provider side"""
+    name: str
+    prompt_version: str
+    expires_at: float
+    token_count: int
+    handle: Any = None
+
+
+@dataclass
+class Usage:
+    cached_tokens: int
+    uncached_tokens: int
+
+
+class GeminiContextCache:
+    """
+    Registers system prompts with the Gemini context caching API. Gemini
+    rejects cached content below a per-model minimum (1024 tokens for the
+    Flash models), so shorter prompts are never registered and always go
+    out in full.
+    """
+
+    MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+    def __init__(self, model: str, min_tokens: Optional[int] = None):
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self._genai = genai
+        self._caching = caching
+        self.model = model if model.startswith("models/") else f"models/{model}"
+        self.min_tokens = self.MIN_TOKENS if min_tokens is None else min_tokens
+
+    def create(self, system_prompt: str, prompt_version: str, ttl: timedelta) -> CachedContext:
+        cached = self._caching.CachedContent.create(
+            model=self.model,
+            display_name=f"system-prompt-{prompt_version[:12]}",
+            system_instruction=system_prompt,
+            ttl=ttl
+        )
+        token_count = getattr(cached.usage_metadata, "total_token_count", 0) or estimate_tokens(system_prompt)
+        return CachedContext(
+            name=cached.name,
+            prompt_version=prompt_version,
+            expires_at=time.time() + ttl.total_seconds(),
+            token_count=token_count,
+            handle=cached
+        )
+
+    def attach(self, name: str, prompt_version: str, expires_at: float, token_count: int) -> CachedContext:
+        """Look up a context another worker registered"""
+        cached = self._caching.CachedContent.get(name=name)
+        return CachedContext(
+            name=cached.name,
+            prompt_version=prompt_version,
+            expires_at=expires_at,
+            token_count=token_count,
+            handle=cached
+        )
+
+    def refresh(self, context: CachedContext, ttl: timedelta):
+        context.handle.update(ttl=ttl)
+        context.expires_at = time.time() + ttl.total_seconds()
+
+    @staticmethod
+    def _contents(messages: List[BaseMessage]) -> List[dict]:
+        return [
+            {"role": "model" if message.type == "ai" else "user", "parts": [message.content]}
+            for message in messages
+        ]
+
+    @staticmethod
+    def _usage(response) -> Usage:
+        usage = response.usage_metadata
+        cached = getattr(usage, "cached_content_token_count", 0) or 0
+        return Usage(cached_tokens=cached, uncached_tokens=max(0, usage.prompt_token_count - cached))
+
+    def generate(self, context: CachedContext, messages: List[BaseMessage]) -> Tuple[str, Usage]:
+        model = self._genai.GenerativeModel.from_cached_content(cached_content=context.handle)
+        response = model.generate_content(self._contents(messages))
+        return response.text, self._usage(response)
+
+    def stream(self, context: CachedContext, messages: List[BaseMessage]) -> Iterator[Tuple[str, Optional[Usage]]]:
+        model = self._genai.GenerativeModel.from_cached_content(cached_content=context.handle)
+        response = model.generate_content(self._contents(messages), stream=True)
+        for chunk in response:
+            yield chunk.text, None
+        yield "", self._usage(response)
+
+
+class FakeContextCache:
+    """
+    Offline stand-in for GeminiContextCache. Generation is delegated to any
+    invoke()/stream() LLM (e.g. FakeLLM); token usage is estimated.
+    """
+
+    def __init__(self, llm, min_tokens: int = 0, fail_create: bool = False):
+        self.llm = llm
+        self.min_tokens = min_tokens
+        self.fail_create = fail_create
+        self.contexts: Dict[str, CachedContext] = {}
+        self.creations = 0
+
+    def create(self, system_prompt: str, prompt_version: str, ttl: timedelta) -> CachedContext:
+        token_count = estimate_tokens(system_prompt)
+        if self.fail_create or token_count < self.min_tokens:
+            raise ValueError("Cached content is below the minimum token count")
+        self.creations += 1
+        context = CachedContext(
+            name=f"cachedContents/fake-{self.creations}",
+            prompt_version=prompt_version,
+            expires_at=time.time() + ttl.total_seconds(),
+            token_count=token_count
+        )
+        self.contexts[context.name] = context
+        return context
+
+    def attach(self, name: str, prompt_version: str, expires_at: float, token_count: int) -> CachedContext:
+        if name not in self.contexts:
+            raise LookupError(f"{name} not found")
+        return self.contexts[name]
+
+    def refresh(self, context: CachedContext, ttl: timedelta):
+        context.expires_at = time.time() + ttl.total_seconds()
+
+    def _usage(self, context: CachedContext, messages: List[BaseMessage]) -> Usage:
+        uncached = sum(estimate_tokens(str(message.content)) for message in messages)
+        return Usage(cached_tokens=context.token_count, uncached_tokens=uncached)
+
+    def generate(self, context: CachedContext, messages: List[BaseMessage]) -> Tuple[str, Usage]:
+        if context.name not in self.contexts or context.expires_at <= time.time():
+            raise LookupError(f"{context.name} not found or expired")
+        return self.llm.invoke(messages), self._usage(context, messages)
+
+    def stream(self, context: CachedContext, messages: List[BaseMessage]) -> Iterator[Tuple[str, Optional[Usage]]]:
+        if context.name not in self.contexts or context.expires_at <= time.time():
+            raise LookupError(f"{context.name} not found or expired")
+        for chunk in self.llm.stream(messages):
+            yield chunk, None
+        yield "", self._usage(context, messages)
+
+
+class PromptCachingLLM:
+    """
+    invoke()/stream() adapter that sends the leading system message as a
+    provider-side cached context, registered once per prompt version and TTL
+    and refreshed shortly before it expires. Any call the cache cannot serve
+    (no backend, prompt below the backend's min_tokens, creation rejected,
+    context gone) transparently goes to the plain LLM with the full message
+    list. Other generate errors, such as a safety block, are raised as they
+    are and keep the context. Registration and refresh run outside the lock, one caller per
+    prompt version; the others keep using the current context or wait.
+
+    With a shared state backend, the registered context name is published
+    there so the other workers attach to it instead of each registering
+    (and paying storage for) their own copy.
+    """
+
+    # Off by default: Gemini only caches prefixes of GeminiContextCache.MIN_TOKENS or more, and the
+    # master prompt alone is well below that
+    ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "false").lower() == "true"
+    TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+    REFRESH_MARGIN_SECONDS = 300
+    # After a failed registration, wait this long before trying again
+    RETRY_AFTER_SECONDS = 600
+    # Longest a call waits for another caller's registration before going uncached
+    REGISTRATION_WAIT_SECONDS = 10
+
+    def __init__(self, llm, backend=None, ttl: Optional[timedelta] = None, state=None):
+        self.llm = llm
+        self.backend = backend
+        self.ttl = ttl or timedelta(seconds=self.TTL_SECONDS)
+        self.state = state
+        self._contexts: Dict[str, CachedContext] = {}
+        self._unavailable_until: Dict[str, float] = {}
+        self._registering: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "cached_calls": 0,
+            "uncached_calls": 0,
+            "cached_input_tokens": 0,
+            "uncached_input_tokens": 0,
+            "contexts_created": 0,
+            "contexts_refreshed": 0,
+            "contexts_attached": 0,
+            "fallbacks": 0,
+        }
+
+    @staticmethod
+    def prompt_version(system_prompt: str) -> str:
+        return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._counters[name] += amount
+
+    def _split(self, messages: List[BaseMessage]) -> Tuple[Optional[str], List[BaseMessage]]:
+        if messages and messages[0].type == "system" and isinstance(messages[0].content, str):
+            return messages[0].content, list(messages[1:])
+        return None, list(messages)
+
+    def _context_for(self, system_prompt: str) -> Optional[CachedContext]:
+        """Return a live cached context for this prompt, creating or refreshing it"""
+        version = self.prompt_version(system_prompt)
+        while True:
+            with self._lock:
+                if self._unavailable_until.get(version, 0) > time.time():
+                    return None
+                context = self._contexts.get(version)
+                if context and context.expires_at - time.time() >= self.REFRESH_MARGIN_SECONDS:
+                    return context
+                registering = self._registering.get(version)
+                if registering is None:
+                    registering = self._registering[version] = threading.Event()
+                    break
+            # Another call is registering this version
+            if context and context.expires_at > time.time():
+                return context
+            if not registering.wait(self.REGISTRATION_WAIT_SECONDS):
+                return None
+
+        try:
+            return self._register(system_prompt, version, context)
+        finally:
+            with self._lock:
+                del self._registering[version]
+            registering.set()
+
+    def _register(self, system_prompt: str, version: str, context: Optional[CachedContext]) -> Optional[CachedContext]:
+        """Refresh, attach or create the context for a version (network calls, no lock held)"""
+        min_tokens = getattr(self.backend, "min_tokens", 0)
+        if estimate_tokens(system_prompt) < min_tokens:
+            print(f"ℹ️ System prompt is below the {min_tokens}-token cache minimum, sending it uncached")
+            with self._lock:
+                self._unavailable_until[version] = float("inf")
+            return None
+        try:
+            if context:
+                try:
+                    self.backend.refresh(context, self.ttl)
+                    self._count(contexts_refreshed=1)
+                    self._publish_context(context)
+                except Exception:
+                    context = None
+            if context is None:
+                context = self._shared_context(version)
+            if context is None:
+                context = self.backend.create(system_prompt, version, self.ttl)
+                self._count(contexts_created=1)
+                self._publish_context(context)
+        except Exception as e:
+            print(f"❌ Prompt cache unavailable, sending full prompt: {e}")
+            with self._lock:
+                self._contexts.pop(version, None)
+                self._unavailable_until[version] = time.time() + self.RETRY_AFTER_SECONDS
+            return None
+        with self._lock:
+            self._contexts[version] = context
+        return context
+
+    def _shared_key(self, version: str) -> str:
+        return f"prompt-cache:{getattr(self.backend, 'model', '')}:{version}"
+
+    def _shared_context(self, version: str) -> Optional[CachedContext]:
+        """Attach to a context another worker registered, if it is still fresh"""
+        if self.state is None:
+            return None
+        try:
+            record = self.state.get(self._shared_key(version))
+            if not record or record["expires_at"] - time.time() < self.REFRESH_MARGIN_SECONDS:
+                return None
+            context = self.backend.attach(record["name"], version, record["expires_at"], record["token_count"])
+        except Exception:
+            return None
+        self._count(contexts_attached=1)
+        return context
+
+    def _publish_context(self, context: CachedContext):
+        if self.state is None:
+            return
+        try:
+            self.state.set(
+                self._shared_key(context.prompt_version),
+                {"name": context.name, "expires_at": context.expires_at, "token_count": context.token_count},
+                ttl=max(1.0, context.expires_at - time.time())
+            )
+        except Exception as e:
+            print(f"❌ Failed to share prompt cache context: {e}")
+
+    def _drop(self, context: CachedContext):
+        with self._lock:
+            if self._contexts.get(context.prompt_version) is context:
+                del self._contexts[context.prompt_version]
+
+    def _record_uncached(self, messages: List[BaseMessage]):
+        tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        self._count(uncached_calls=1, uncached_input_tokens=tokens)
+
+    def _record_cached(self, usage: Usage):
+        self._count(
+            cached_calls=1,
+            cached_input_tokens=usage.cached_tokens,
+            uncached_input_tokens=usage.uncached_tokens
+        )
+
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> str:
+        system_prompt, turns = self._split(messages)
+        context = self._context_for(system_prompt) if self.backend and system_prompt else None
+
+        if context:
+            try:
+                text, usage = self.backend.generate(context, turns)
+                self._record_cached(usage)
+                return text
+            except Exception as e:
+                if not is_context_missing(e):
+                    raise
+                self._drop(context)
+                self._count(fallbacks=1)
+
+        self._record_uncached(messages)
+        return self.llm.invoke(messages, **kwargs)
+
+    def stream(self, messages: List[BaseMessage], **kwargs) -> Iterator[str]:
+        system_prompt, turns = self._split(messages)
+        context = self._context_for(system_prompt) if self.backend and system_prompt else None
+
+        if context:
+            yielded = False
+            try:
+                for text, usage in self.backend.stream(context, turns):
+                    if usage:
+                        self._record_cached(usage)
+                    if text:
+                        yielded = True
+                        yield text
+                return
+            except Exception as e:
+                if yielded or not is_context_missing(e):
+                    raise
+                self._drop(context)
+                self._count(fallbacks=1)
+
+        self._record_uncached(messages)
+        yield from self.llm.stream(messages, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["active_contexts"] = len(self._contexts)
+        total = counters["cached_input_tokens"] + counters["uncached_input_tokens"]
+        counters["cached_token_ratio"] = counters["cached_input_tokens"] / total if total else None
+        return counters
@@ -0,0 +1,106 @@
+"""
+Bulk user provisioning from CSV or NDJSON
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+from auth.jwt_utils import JWTUtils
+from services.mongodb_service import MongoDBService
+
+
+class UserProvisioner:
+    """
+    Streams user rows from a file, hashes passwords in parallel across a
+    process pool (bcrypt is CPU-bound and holds the GIL) and writes them
+    with unordered insert_many batches. Only one batch is held in memory.
+    """
+
+    FORMATS = ("csv", "ndjson")
+    BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        mongo_service: MongoDBService,
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None
+    ):
+        self.mongo_service = mongo_service
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.workers = workers or os.cpu_count() or 1
+
+    def read_rows(self, source: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+        """Yield (line number, row, error) for every record in the source"""
+        if fmt == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row, None
+        elif fmt == "ndjson":
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, None, f"Invalid JSON: {e.msg}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, None, "Expected a JSON object"
+                    continue
+                yield line_number, row, None
+        else:
+            raise ValueError(f"Unsupported format: {fmt}")
+
+    def provision(self, source: TextIO, fmt: str) -> dict:
+        """Provision every user in the source and return a report"""
+        started = time.monotonic()
+        report = {"rows": 0, "inserted": 0, "duplicates": [], "errors": []}
+        seen = set()
+        batch: List[Tuple[int, str, str]] = []
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for line_number, row, error in self.read_rows(source, fmt):
+                report["rows"] += 1
+                if error is None:
+                    username = str(row.get("username") or "").strip()
+                    password = str(row.get("password") or "")
+                    if not username or not password:
+                        error = "username and password are required"
+                    elif username in seen:
+                        report["duplicates"].append(username)
+                        continue
+                if error:
+                    report["errors"].append({"line": line_number, "error": error})
+                    continue
+
+                seen.add(username)
+                batch.append((line_number, username, password))
+                if len(batch) >= self.batch_size:
+                    self._write_batch(pool, batch, report)
+                    batch = []
+
+            if batch:
+                self._write_batch(pool, batch, report)
+
+        elapsed = time.monotonic() - started
+        report["seconds"] = round(elapsed, 3)
+        report["users_per_sec"] = round(report["inserted"] / elapsed, 1) if elapsed else None
+        return report
+
+    def _write_batch(self, pool: ProcessPoolExecutor, batch: List[Tuple[int, str, str]], report: dict):
+        chunksize = max(1, len(batch) // (self.workers * 4))
+        hashes = pool.map(JWTUtils.hash_password, [password for _, _, password in batch], chunksize=chunksize)
+        now = datetime.utcnow()
+        user_docs = [
+            {"username": username, "hashed_password": hashed, "created_at": now}
+            for (_, username, _), hashed in zip(batch, hashes)
+        ]
+
+        result = self.mongo_service.insert_users(user_docs)
+        report["inserted"] += result["inserted"]
+        report["duplicates"].extend(result["duplicates"])
+        report["errors"].extend(result["errors"])
@@ -0,0 +1,85 @@
+"""
+Chat history search: ranking comes from the Mongo text index, snippets are built here
+"""
+import re
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+
+from services.mongodb_service import MongoDBService
+
+
+class ChatSearch:
+    """Runs paginated searches and builds highlighted snippets for each hit"""
+
+    SNIPPET_RADIUS = 80
+
+    def __init__(self, mongo_service: MongoDBService):
+        self.mongo_service = mongo_service
+
+    def search(self, user_id: str, query: str, page: int = 1, page_size: int = 20) -> Tuple[List[dict], bool]:
+        """Return one page of results and whether another page exists"""
+        terms = self.query_terms(query)
+        if not terms:
+            return [], False
+
+        docs = self.mongo_service.search_user_chats(
+            user_id,
+            " ".join(terms),
+            skip=(page - 1) * page_size,
+            limit=page_size + 1
+        )
+        has_more = len(docs) > page_size
+
+        results = []
+        for doc in docs[:page_size]:
+            snippet, highlights = self.build_snippet(doc["messages"], terms)
+            results.append({
+                "chat_id": doc["id"],
+                "score": doc.get("score", 0.0),
+                "last_updated": doc["last_updated"],
+                "snippet": snippet,
+                "highlights": highlights,
+            })
+        return results, has_more
+
+    @staticmethod
+    def query_terms(query: str) -> List[str]:
+        """Distinct lowercase terms of a search query"""
+        return list(dict.fromkeys(re.findall(r"[a-z0-9][a-z0-9'-]{1,39}", query.lower())))
+
+    def build_snippet(self, messages: List[BaseMessage], terms: List[str]) -> Tuple[str, List[List[int]]]:
+        """
+        Pick the message with the most term hits and cut a window around the
+        first hit. Highlights are [start, end] offsets into the snippet, so
+        the client decides how to render them.
+        """
+        pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+
+        best: Optional[str] = None
+        best_hits = 0
+        for message in messages:
+            if message.type not in ("human", "ai") or not isinstance(message.content, str):
+                continue
+            hits = len(pattern.findall(message.content))
+            if hits > best_hits:
+                best, best_hits = message.content, hits
+
+        if best is None:
+            # The index stems terms, so a hit may not match the raw text
+            text = next(
+                (m.content for m in messages if m.type == "human" and isinstance(m.content, str)),
+                ""
+            )
+            snippet = " ".join(text[:2 * self.SNIPPET_RADIUS].split("\n"))
+            return snippet + ("..." if len(text) > 2 * self.SNIPPET_RADIUS else ""), []
+
+        first = pattern.search(best)
+        start = max(0, first.start() - self.SNIPPET_RADIUS)
+        end = min(len(best), first.end() + self.SNIPPET_RADIUS)
+        prefix = "..." if start > 0 else ""
+        suffix = "..." if end < len(best) else ""
+        snippet = prefix + " ".join(best[start:end].split("\n")) + suffix
+
+        highlights = [[match.start(), match.end()] for match in pattern.finditer(snippet)]
+        return snippet, highlights
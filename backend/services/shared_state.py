@@ -0,0 +1,284 @@
+"""
+Pluggable state shared between server worker processes
+"""
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How long published messages are kept for pollers that fell behind
+MESSAGE_RETENTION_SECONDS = 300
+
+
+class InProcessStateBackend:
+    """
+    Key-value store with TTLs, atomic counters and a polled message log,
+    all inside one process. Correct for a single worker only.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._messages: "deque[Tuple[int, str, Any, float]]" = deque()
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[Any, Optional[float]]]:
+        entry = self._values.get(key)
+        if entry and entry[1] is not None and entry[1] <= now:
+            del self._values[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._live(key, now):
+                return False
+            self._values[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        """Live keys starting with prefix, with their values"""
+        now = time.time()
+        with self._lock:
+            return {
+                key: entry[0] for key in [key for key in self._values if key.startswith(prefix)]
+                for entry in [self._live(key, now)] if entry
+            }
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add to a counter; the TTL applies when the counter is created"""
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry:
+                value, expires_at = entry[0] + amount, entry[1]
+            else:
+                value, expires_at = amount, now + ttl if ttl else None
+            self._values[key] = (value, expires_at)
+            return value
+
+    def publish(self, channel: str, message: Any) -> int:
+        now = time.time()
+        with self._lock:
+            message_id = next(self._ids)
+            self._last_id = message_id
+            self._messages.append((message_id, channel, message, now))
+            while self._messages and self._messages[0][3] < now - MESSAGE_RETENTION_SECONDS:
+                self._messages.popleft()
+            return message_id
+
+    def poll(self, channel: str, since_id: int) -> Tuple[int, List[Any]]:
+        """Messages on a channel after since_id, and the id to poll from next"""
+        with self._lock:
+            messages = [
+                message for message_id, message_channel, message, _ in self._messages
+                if message_id > since_id and message_channel == channel
+            ]
+            return max(since_id, self._last_id), messages
+
+    def read(self, channel: str, since_id: int) -> List[Tuple[int, Any]]:
+        """Messages on a channel after since_id, with their ids"""
+        with self._lock:
+            return [
+                (message_id, message) for message_id, message_channel, message, _ in self._messages
+                if message_id > since_id and message_channel == channel
+            ]
+
+    def latest_id(self) -> int:
+        with self._lock:
+            return self._last_id
+
+    def oldest_id(self) -> Optional[int]:
+        """Id of the oldest retained message, None when none are retained"""
+        with self._lock:
+            return self._messages[0][0] if self._messages else None
+
+
+class SqliteStateBackend:
+    """
+    Same interface backed by a SQLite file in WAL mode, so every worker
+    process on the host sees the same keys, counters and messages. Stands in
+    for a local key-value server without adding a service to deploy.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0.0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+            "payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+            (key, json.dumps(value), now + ttl if ttl else None, now)
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def scan(self, prefix: str) -> Dict[str, Any]:
+        """Live keys starting with prefix, with their values"""
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (len(prefix), prefix, time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add to a counter; the TTL applies when the counter is created"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            if row:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            else:
+                value, expires_at = amount, now + ttl if ttl else None
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def publish(self, channel: str, message: Any) -> int:
+        conn = self._conn()
+        now = time.time()
+        cursor = conn.execute(
+            "INSERT INTO messages (channel, payload, created_at) VALUES (?, ?, ?)",
+            (channel, json.dumps(message), now)
+        )
+        if now - self._purged_at > 60:
+            self._purged_at = now
+            conn.execute("DELETE FROM messages WHERE created_at < ?", (now - MESSAGE_RETENTION_SECONDS,))
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        return cursor.lastrowid
+
+    def poll(self, channel: str, since_id: int) -> Tuple[int, List[Any]]:
+        """Messages on a channel after since_id, and the id to poll from next"""
+        rows = self._conn().execute(
+            "SELECT id, payload FROM messages WHERE channel = ? AND id > ? ORDER BY id",
+            (channel, since_id)
+        ).fetchall()
+        next_id = rows[-1][0] if rows else since_id
+        return next_id, [json.loads(payload) for _, payload in rows]
+
+    def read(self, channel: str, since_id: int) -> List[Tuple[int, Any]]:
+        """Messages on a channel after since_id, with their ids"""
+        rows = self._conn().execute(
+            "SELECT id, payload FROM messages WHERE channel = ? AND id > ? ORDER BY id",
+            (channel, since_id)
+        ).fetchall()
+        return [(message_id, json.loads(payload)) for message_id, payload in rows]
+
+    def latest_id(self) -> int:
+        row = self._conn().execute("SELECT MAX(id) FROM messages").fetchone()
+        return row[0] or 0
+
+    def oldest_id(self) -> Optional[int]:
+        """Id of the oldest retained message, None when none are retained"""
+        row = self._conn().execute("SELECT MIN(id) FROM messages").fetchone()
+        return row[0]
+
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "stunning_task_state.db")
+
+
+def create_state_backend(url: Optional[str] = None):
+    """
+    Build the backend named by SHARED_STATE_URL:
+        memory://            in-process (single worker)
+        sqlite:///path.db    shared by all workers on this host
+                             (sqlite:////abs/path.db for an absolute path,
+                             sqlite:/// alone for a file in the temp dir)
+    """
+    url = url or os.getenv("SHARED_STATE_URL", "memory://")
+    if url.startswith("memory://"):
+        return InProcessStateBackend()
+    if url.startswith("sqlite:///"):
+        return SqliteStateBackend(url[len("sqlite:///"):] or DEFAULT_SQLITE_PATH)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+class RateLimiter:
+    """Fixed-window limiter whose counters live in the shared state backend"""
+
+    def __init__(self, state, name: str, limit: int, window_seconds: int = 60):
+        self.state = state
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+
+    def allow(self, identity: str, cost: int = 1) -> bool:
+        """Count cost events for identity; False once the window's limit is exceeded"""
+        if self.limit <= 0:
+            return True
+        window = int(time.time() // self.window_seconds)
+        key = f"ratelimit:{self.name}:{identity}:{window}"
+        return self.state.incr(key, cost, ttl=self.window_seconds * 2) <= self.limit
@@ -0,0 +1,325 @@
+"""
+Write-behind group commit for chat message appends
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+load_dotenv()
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class PendingWrite:
+    """Handle for one queued append; wait() blocks until it has been flushed"""
+
+    def __init__(self, write_id: ObjectId, chat_id: str, chat_update: dict, history_doc: Optional[dict]):
+        self.write_id = write_id
+        self.chat_id = chat_id
+        self.chat_update = chat_update
+        self.history_doc = history_doc
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+
+    def resolve(self, error: Optional[BaseException] = None):
+        self.error = error
+        self._done.set()
+
+    def done(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the write to be attempted, without raising its error"""
+        return self._done.wait(timeout)
+
+    def wait(self, timeout: Optional[float] = None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for message write to be flushed")
+        if self.error:
+            raise self.error
+
+
+class WriteBehindQueue:
+    """
+    Collects message appends from concurrent turns and writes them as one
+    ordered bulk_write per collection, triggered by batch size or time.
+
+    Modes:
+        off      - every append is written synchronously by the caller
+        enqueue  - the caller returns as soon as the append is queued
+        flush    - the caller blocks until the batch holding its append is written
+
+    Appends are idempotent: each carries a write id that is recorded on the
+    chat (last APPLIED_IDS_KEPT ids) and used as the history document _id,
+    so a batch retried after an ambiguous network error is not applied twice.
+
+    With a shared state backend each worker mirrors its own per-chat pending
+    count there under a key it alone writes, so another worker can wait for
+    appends queued here before it reads the chat.
+    """
+
+    MODES = ("off", "enqueue", "flush")
+    MODE = os.getenv("WRITE_BEHIND_MODE", "off").lower()
+    BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+    FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "50"))
+    MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+    APPLIED_IDS_KEPT = 32
+    # Shared pending counts expire in case a worker dies with writes queued;
+    # every change to a count rewrites it with a fresh TTL
+    SHARED_PENDING_TTL_SECONDS = 60
+
+    def __init__(
+        self,
+        chats_collection,
+        history_collection,
+        mode: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        state=None
+    ):
+        self.chats_collection = chats_collection
+        self.history_collection = history_collection
+        self.mode = (mode or self.MODE).lower()
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown write-behind mode: {self.mode}")
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.flush_interval = self.FLUSH_INTERVAL_MS / 1000 if flush_interval is None else flush_interval
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.state = state
+
+        self._queue: "deque[PendingWrite]" = deque()
+        self._pending_by_chat: Dict[str, int] = defaultdict(int)
+        self._in_flight: List[PendingWrite] = []
+        self._condition = threading.Condition()
+        # Serializes publishing pending counts so an older count never overwrites a newer one
+        self._shared_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._flush_requested = False
+        self._counters = {
+            "enqueued": 0,
+            "flushed": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed": 0,
+            "remote_waits": 0,
+            "last_flush_ms": None,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    # Lifecycle
+    def start(self):
+        with self._condition:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Flush everything still queued and stop the flusher thread"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Producer side
+    def submit(self, chat_id: str, chat_update: dict, history_doc: Optional[dict] = None) -> PendingWrite:
+        """Queue one append; chat_update is the update document for the chat"""
+        write_id = ObjectId()
+        chat_update = dict(chat_update)
+        push = dict(chat_update.get("$push", {}))
+        push["applied_writes"] = {"$each": [write_id], "$slice": -self.APPLIED_IDS_KEPT}
+        chat_update["$push"] = push
+        if history_doc is not None:
+            history_doc = dict(history_doc, _id=write_id)
+
+        pending = PendingWrite(write_id, chat_id, chat_update, history_doc)
+        self.start()
+        with self._condition:
+            self._queue.append(pending)
+            self._pending_by_chat[chat_id] += 1
+            self._counters["enqueued"] += 1
+            # Wake the flusher to start the batch timer, or to flush a full batch
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+        self._publish_pending(chat_id)
+
+        if self.mode == "flush":
+            pending.wait()
+        return pending
+
+    def pending_count(self, chat_id: str) -> int:
+        """Appends for this chat that are queued or being written"""
+        with self._condition:
+            return self._pending_by_chat.get(chat_id, 0)
+
+    def _publish_pending(self, chat_id: str):
+        """Mirror this worker's current pending count for a chat to the shared state"""
+        if self.state is None:
+            return
+        key = f"writebehind:pending:{chat_id}:{os.getpid()}"
+        try:
+            with self._shared_lock:
+                count = self.pending_count(chat_id)
+                if count > 0:
+                    self.state.set(key, count, ttl=self.SHARED_PENDING_TTL_SECONDS)
+                else:
+                    self.state.delete(key)
+        except Exception as e:
+            print(f"❌ Failed to update shared pending count: {e}")
+
+    def _pending_elsewhere(self, chat_id: str) -> int:
+        own_key = f"writebehind:pending:{chat_id}:{os.getpid()}"
+        counts = self.state.scan(f"writebehind:pending:{chat_id}:")
+        return sum(count for key, count in counts.items() if key != own_key)
+
+    def wait_for_other_workers(self, chat_id: str, timeout: float = 2.0) -> bool:
+        """
+        Block until appends other workers queued for this chat are written.
+        Returns False if they are still pending when the timeout expires.
+        """
+        if self.state is None:
+            return True
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            if self._pending_elsewhere(chat_id) <= 0:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            if not waited:
+                waited = True
+                with self._condition:
+                    self._counters["remote_waits"] += 1
+            time.sleep(max(0.005, self.flush_interval / 2))
+
+    def flush(self, timeout: float = 30.0):
+        """Block until everything queued so far has been written"""
+        with self._condition:
+            targets = list(self._in_flight) + list(self._queue)
+            self._flush_requested = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for pending in targets:
+            if not pending.done(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError("Timed out flushing queued message writes")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            counters = dict(self._counters)
+            counters.update({
+                "mode": self.mode,
+                "queue_depth": len(self._queue),
+                "avg_batch_size": counters["flushed"] / counters["batches"] if counters["batches"] else None,
+            })
+        return counters
+
+    # Flusher side
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._queue and len(self._queue) < self.batch_size and not (self._stopping or self._flush_requested):
+                    self._condition.wait(self.flush_interval)
+                if not self._queue:
+                    if self._stopping:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not self._queue:
+                    self._flush_requested = False
+                self._in_flight = batch
+
+            errors = self._write_batch(batch)
+
+            with self._condition:
+                self._in_flight = []
+                for pending in batch:
+                    self._pending_by_chat[pending.chat_id] -= 1
+                    if self._pending_by_chat[pending.chat_id] <= 0:
+                        del self._pending_by_chat[pending.chat_id]
+            for chat_id in {pending.chat_id for pending in batch}:
+                self._publish_pending(chat_id)
+            for pending in batch:
+                pending.resolve(errors.get(pending.write_id))
+
+    def _write_batch(self, batch: List[PendingWrite]) -> Dict[ObjectId, BaseException]:
+        """Write a batch and return the errors of the appends that were not applied, by write id"""
+        started = time.monotonic()
+        chat_ops = [
+            (
+                pending.write_id,
+                UpdateOne(
+                    {"_id": ObjectId(pending.chat_id), "applied_writes": {"$ne": pending.write_id}},
+                    pending.chat_update
+                )
+            )
+            for pending in batch
+        ]
+        errors = self._bulk_write_with_retry(self.chats_collection, chat_ops)
+        # A history entry is only written for a message that made it into its chat
+        history_ops = [
+            (pending.write_id, InsertOne(pending.history_doc))
+            for pending in batch
+            if pending.history_doc and pending.write_id not in errors
+        ]
+        errors.update(self._bulk_write_with_retry(self.history_collection, history_ops))
+
+        with self._condition:
+            self._counters["batches"] += 1
+            self._counters["last_flush_ms"] = round((time.monotonic() - started) * 1000, 2)
+            self._counters["failed"] += len(errors)
+            self._counters["flushed"] += len(batch) - len(errors)
+        if errors:
+            print(f"❌ Write-behind failed {len(errors)} of {len(batch)} appends: {next(iter(errors.values()))}")
+        return errors
+
+    def _bulk_write_with_retry(self, collection, ops: list) -> Dict[ObjectId, BaseException]:
+        """
+        Run (write id, op) pairs as ordered bulk writes. Ops before a write
+        error were applied and ops after it were not sent, so only the op at
+        the error index fails; a duplicate key there means an earlier attempt
+        already applied it. Errors without a failing index (network, write
+        concern) retry everything not yet known to be applied, which the
+        idempotent ops make safe.
+        """
+        errors: Dict[ObjectId, BaseException] = {}
+        attempt = 0
+        while ops:
+            try:
+                collection.bulk_write([op for _, op in ops], ordered=True)
+                return errors
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                first = write_errors[0] if write_errors else None
+                if first is not None:
+                    index = first["index"]
+                    if first["code"] != DUPLICATE_KEY_ERROR:
+                        errors[ops[index][0]] = e
+                    ops = ops[index + 1:]
+                    continue
+                error = e
+            except PyMongoError as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                for write_id, _ in ops:
+                    errors[write_id] = error
+                return errors
+            attempt += 1
+            with self._condition:
+                self._counters["retries"] += 1
+            time.sleep(min(2.0, 0.05 * (2 ** attempt)))
+        return errors
@@ -0,0 +1,44 @@
+"""
+Archive chats that have been inactive for a while out of the primary collection
+
+Usage:
+    python testing/archive_chats.py --days 90 --dry-run
+    python testing/archive_chats.py --days 90
+"""
+import argparse
+import os
+import sys
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.mongodb_service import MongoDBService
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move inactive chats to the archive collection")
+    parser.add_argument("--days", type=int, default=MongoDBService.ARCHIVE_AFTER_DAYS,
+                        help="Archive chats not updated for this many days")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved")
+    args = parser.parse_args()
+
+    mongo_service = MongoDBService()
+    report = mongo_service.archive_inactive_chats(timedelta(days=args.days), dry_run=args.dry_run)
+
+    prefix = "Would archive" if args.dry_run else "Archived"
+    print(f"✅ {prefix} {report['chats_archived']} chat(s) last updated before {report['cutoff']:%Y-%m-%d}")
+    if report["chats_skipped"]:
+        print(f"Skipped {report['chats_skipped']} chat(s) updated during archiving")
+    print(f"Bytes moved out of primary: {report['bytes_moved']}")
+    print(f"Archive payload bytes: {report['archive_bytes']}")
+    print(f"Primary collection: {report['collection_bytes_before']} -> {report['collection_bytes_after']} bytes "
+          f"({report['working_set_reduction']:.1%} smaller)")
+
+
+if __name__ == "__main__":
+    main()
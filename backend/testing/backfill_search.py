@@ -0,0 +1,25 @@
+"""
+Populate the search index terms for chats created before search was added
+"""
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.mongodb_service import MongoDBService
+
+load_dotenv()
+
+
+def main():
+    mongo_service = MongoDBService()
+    mongo_service.ensure_indexes()
+    updated = mongo_service.backfill_search_terms()
+    print(f"✅ Indexed {updated} chat(s) for search")
+
+
+if __name__ == "__main__":
+    main()
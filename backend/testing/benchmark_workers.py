@@ -0,0 +1,152 @@
+"""
+Measure throughput and latency of the server at different worker counts
+
+Starts the server once per worker count, drives it with client processes
+over keep-alive connections and prints requests/sec, latency percentiles
+and scaling relative to the first worker count.
+
+The default path is the authenticated chat list, which exercises JWT
+checks and MongoDB reads; pass --path /health to measure bare overhead.
+
+Usage:
+    python testing/benchmark_workers.py --workers 1 2 4 8 --username <user> --password <password>
+    python testing/benchmark_workers.py --workers 1 4 --token <jwt>
+    python testing/benchmark_workers.py --workers 1 4 --path /health
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_ready(port: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def login(port: int, username: str, password: str) -> str:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(
+            "POST",
+            "/api/login",
+            body=json.dumps({"username": username, "password": password}),
+            headers={"Content-Type": "application/json"}
+        )
+        response = conn.getresponse()
+        body = response.read()
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"Login failed with status {response.status}")
+    return json.loads(body)["access_token"]
+
+
+def run_client(args) -> tuple:
+    """One client process: sequential requests on a keep-alive connection"""
+    port, path, token, duration = args
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.monotonic() - started)
+    conn.close()
+    return latencies, errors
+
+
+def percentile(samples: list, quantile: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(round(quantile * (len(samples) - 1))))]
+
+
+def benchmark(workers: int, args) -> dict:
+    env = dict(os.environ, DEBUG="false", WEB_CONCURRENCY=str(workers), PORT=str(args.port))
+    server = subprocess.Popen(
+        [sys.executable, "server.py"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_until_ready(args.port, args.startup_timeout):
+            raise RuntimeError(f"Server with {workers} worker(s) did not become ready")
+        token = args.token
+        if not token and args.username:
+            token = login(args.port, args.username, args.password)
+        # Warm up every worker before measuring
+        with Pool(args.clients) as pool:
+            pool.map(run_client, [(args.port, args.path, token, 1.0)] * args.clients)
+            results = pool.map(run_client, [(args.port, args.path, token, args.duration)] * args.clients)
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "rps": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server at different worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=(os.cpu_count() or 2) * 2,
+                        help="Concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure per worker count")
+    parser.add_argument("--path", default="/api/chats")
+    parser.add_argument("--token", help="JWT for authenticated paths")
+    parser.add_argument("--username", help="Log in as this user to get a JWT for authenticated paths")
+    parser.add_argument("--password", help="Password for --username")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    if args.path.startswith("/api/") and not (args.token or (args.username and args.password)):
+        parser.error(f"{args.path} needs --token or --username and --password")
+
+    print(f"{'workers':>7} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'efficiency':>10}")
+    baseline = None
+    for workers in args.workers:
+        result = benchmark(workers, args)
+        baseline = baseline or result["rps"] / workers
+        scaling = result["rps"] / (baseline * workers) if baseline else 0.0
+        print(f"{result['workers']:>7} {result['rps']:>10.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f} {result['errors']:>7} {scaling:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
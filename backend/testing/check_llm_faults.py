@@ -0,0 +1,329 @@
+"""
+Drive the LLM resilience, prompt cache and model routing layers against the fault-injecting fakes
+
+Runs offline (no API key or network) and exits non-zero if any check fails.
+
+Usage:
+    python testing/check_llm_faults.py
+"""
+import os
+import sys
+import threading
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fake_llm import FakeLLM
+from services.llm_resilience import (
+    ResilientLLM, CircuitBreaker, RetryBudget,
+    CircuitOpenError, LLMTimeoutError, LLMUnavailableError
+)
+from services.prompt_cache import PromptCachingLLM, FakeContextCache
+from services.model_router import TieredModelRouter, ModelTier
+
+MESSAGES = [HumanMessage(content="A landing page for a bakery")]
+SYSTEM_PROMPT = "You are a website architect. " * 40
+BLUEPRINT = """**[UPGRADE SUMMARY]**
+A neighbourhood bakery with online pre-orders.
+---
+**[THE MASTER PROMPT]**
+ **Vision:** Warm, artisanal, local.
+ **Visual DNA:** --primary: hsl(25 60% 45%)
+ **Content Blueprint:**
+ - **Hero Section:** Fresh every morning
+ - **Features:** Pre-orders, subscriptions, catering
+ - **Trust Layer:** Reviews from regulars
+ **SEO/Tech:** H1 "Fresh bread in Leeds"
+---
+**[ARCHITECT'S LOG]**
+Focused on morning routines.
+"""
+
+
+class BadRequest(Exception):
+    """Non-retryable provider error, like a 400"""
+    code = 400
+
+
+def no_sleep(seconds: float):
+    pass
+
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_retries_exhausted():
+    llm = ResilientLLM(FakeLLM(failure_rate=1.0), timeout=1, max_retries=2, sleep=no_sleep)
+    try:
+        llm.invoke(MESSAGES)
+        expect(False, "a failing LLM should raise")
+    except LLMUnavailableError:
+        pass
+    metrics = llm.metrics()
+    expect(metrics["attempts"] == 3, f"expected 3 attempts, got {metrics['attempts']}")
+    expect(metrics["retries"] == 2, f"expected 2 retries, got {metrics['retries']}")
+
+
+def check_retry_budget_exhausted():
+    llm = ResilientLLM(
+        FakeLLM(failure_rate=1.0),
+        timeout=1,
+        max_retries=5,
+        retry_budget=RetryBudget(ratio=0.0, min_tokens=1.0),
+        sleep=no_sleep
+    )
+    for _ in range(2):
+        try:
+            llm.invoke(MESSAGES)
+        except LLMUnavailableError:
+            pass
+    metrics = llm.metrics()
+    expect(metrics["retries"] == 1, f"budget allowed {metrics['retries']} retries instead of 1")
+    expect(metrics["budget_exhausted"] == 2, "both calls should stop on an empty budget")
+
+
+def check_deadline_timeout():
+    llm = ResilientLLM(FakeLLM(hang_rate=1.0, hang_seconds=1.0), timeout=0.1, max_retries=0, sleep=no_sleep)
+    started = time.monotonic()
+    try:
+        llm.invoke(MESSAGES)
+        expect(False, "a hanging LLM should time out")
+    except LLMUnavailableError as e:
+        expect(isinstance(e.__cause__, LLMTimeoutError), f"expected a timeout, got {e.__cause__!r}")
+    expect(time.monotonic() - started < 0.5, "the deadline did not cut the call short")
+    expect(llm.metrics()["timeouts"] == 1, "the timeout was not counted")
+
+
+def check_breaker_cycle():
+    fake = FakeLLM(failure_rate=1.0)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    llm = ResilientLLM(fake, timeout=1, max_retries=0, breaker=breaker, sleep=no_sleep)
+    for _ in range(2):
+        try:
+            llm.invoke(MESSAGES)
+        except LLMUnavailableError:
+            pass
+    expect(breaker.state == CircuitBreaker.OPEN, f"breaker should be open, is {breaker.state}")
+    try:
+        llm.invoke(MESSAGES)
+        expect(False, "an open breaker should reject the call")
+    except CircuitOpenError:
+        pass
+
+    # After the reset timeout one probe goes through; a non-retryable error
+    # frees the probe slot without reopening the breaker
+    time.sleep(0.25)
+    fake.error_factory = BadRequest
+    try:
+        llm.invoke(MESSAGES)
+    except LLMUnavailableError:
+        pass
+    expect(breaker.state == CircuitBreaker.HALF_OPEN, f"breaker should be half-open, is {breaker.state}")
+
+    fake.failure_rate = 0.0
+    llm.invoke(MESSAGES)
+    expect(breaker.state == CircuitBreaker.CLOSED, f"breaker should be closed, is {breaker.state}")
+
+
+def check_bad_requests_keep_breaker_closed():
+    llm = ResilientLLM(
+        FakeLLM(failure_rate=1.0, error_factory=BadRequest),
+        timeout=1,
+        max_retries=2,
+        breaker=CircuitBreaker(failure_threshold=2),
+        sleep=no_sleep
+    )
+    for _ in range(5):
+        try:
+            llm.invoke(MESSAGES)
+        except LLMUnavailableError:
+            pass
+    metrics = llm.metrics()
+    expect(metrics["circuit_state"] == CircuitBreaker.CLOSED, "bad requests opened the breaker")
+    expect(metrics["retries"] == 0, "bad requests were retried")
+
+
+def check_hedge_wins():
+    fake = FakeLLM(latency=0.1)
+    llm = ResilientLLM(fake, timeout=2, max_retries=0, hedge=True, hedge_min_samples=3, sleep=no_sleep)
+    for _ in range(3):
+        llm.invoke(MESSAGES)
+
+    # The primary hangs; the fault is switched off before the hedge is sent
+    fake.latency = 0.0
+    fake.hang_rate = 1.0
+    fake.hang_seconds = 1.0
+    threading.Timer(0.03, setattr, (fake, "hang_rate", 0.0)).start()
+    started = time.monotonic()
+    llm.invoke(MESSAGES)
+    metrics = llm.metrics()
+    expect(metrics["hedges_sent"] == 1 and metrics["hedges_won"] == 1, f"hedge did not win: {metrics}")
+    expect(time.monotonic() - started < 0.5, "the hedged call waited for the hanging primary")
+
+
+def check_prompt_cache():
+    backend = FakeContextCache(FakeLLM(responses=["cached reply"]))
+    llm = PromptCachingLLM(FakeLLM(responses=["full reply"]), backend)
+    messages = [SystemMessage(content=SYSTEM_PROMPT)] + MESSAGES
+
+    expect(llm.invoke(messages) == "cached reply", "first call was not served from the cache")
+    expect(backend.creations == 1, "the context was not created")
+    llm.invoke(messages)
+    expect(backend.creations == 1, "the context was created twice")
+
+    # Close to expiry the context is refreshed, not recreated
+    context = next(iter(backend.contexts.values()))
+    context.expires_at = time.time() + 10
+    llm.invoke(messages)
+    metrics = llm.metrics()
+    expect(metrics["contexts_refreshed"] == 1, "the context was not refreshed")
+    expect(backend.creations == 1, "refresh created a new context")
+
+    # Other generate errors, like a safety block, are raised and keep the context
+    backend.llm.failure_rate = 1.0
+    backend.llm.error_factory = BadRequest
+    try:
+        llm.invoke(messages)
+        expect(False, "a rejected cached call should raise")
+    except BadRequest:
+        pass
+    expect(llm.metrics()["active_contexts"] == 1, "a rejected cached call dropped the context")
+    backend.llm.failure_rate = 0.0
+
+    # A context the provider dropped falls back to the full prompt
+    backend.contexts.clear()
+    expect(llm.invoke(messages) == "full reply", "a lost context did not fall back to the full prompt")
+    expect(llm.metrics()["fallbacks"] == 1, "the fallback was not counted")
+
+    # Rejected creation and prompts below the minimum go uncached
+    rejected = PromptCachingLLM(FakeLLM(responses=["full reply"]), FakeContextCache(FakeLLM(), fail_create=True))
+    expect(rejected.invoke(messages) == "full reply", "a rejected creation did not fall back")
+    small = PromptCachingLLM(FakeLLM(responses=["full reply"]), FakeContextCache(FakeLLM(), min_tokens=10_000))
+    expect(small.invoke(messages) == "full reply", "a short prompt was not sent uncached")
+    expect(small.backend.creations == 0, "a prompt below the minimum was registered")
+
+
+def make_router(fast_llm, strong_llm=None, fast_slots: int = 4) -> TieredModelRouter:
+    return TieredModelRouter(
+        fast=ModelTier(name="fast", llm=fast_llm, max_concurrency=fast_slots),
+        strong=ModelTier(name="strong", llm=strong_llm or FakeLLM(responses=["strong reply"]), max_concurrency=4),
+        enabled=True
+    )
+
+
+def failing_tier(error_factory=None) -> ResilientLLM:
+    fake = FakeLLM(failure_rate=1.0, error_factory=error_factory) if error_factory else FakeLLM(failure_rate=1.0)
+    return ResilientLLM(fake, timeout=1, max_retries=0, sleep=no_sleep)
+
+
+def check_routing_choice():
+    router = make_router(FakeLLM())
+    with_blueprint = [HumanMessage(content="A bakery site"), AIMessage(content=BLUEPRINT)]
+    cases = [
+        ([HumanMessage(content="hi")], None, "fast"),
+        ([HumanMessage(content="A landing page for a bakery with online pre-orders")], None, "strong"),
+        ([HumanMessage(content="x" * 2000)], None, "strong"),
+        (with_blueprint + [HumanMessage(content="Make it warmer")], None, "fast"),
+        ([HumanMessage(content="hi")], "blueprint", "strong"),
+        ([HumanMessage(content="x" * 2000)], "refine", "fast"),
+    ]
+    for messages, intent, expected in cases:
+        tier, reason = router.choose(router.features(messages, intent))
+        expect(tier.name == expected, f"{reason!r} picked {tier.name}, expected {expected}")
+    router.enabled = False
+    expect(router.choose(router.features(MESSAGES))[0].name == "strong", "disabled routing should use strong")
+
+
+def check_escalation_rules():
+    plain = TieredModelRouter.features(MESSAGES)
+    section = TieredModelRouter.features(MESSAGES, "refine", section_only=True)
+    refine = TieredModelRouter.features(MESSAGES, "refine")
+    expect(TieredModelRouter.needs_escalation("  ", plain), "an empty reply should escalate")
+    expect(TieredModelRouter.needs_escalation("**[THE MASTER PROMPT]** only", plain), "a broken blueprint should escalate")
+    expect(not TieredModelRouter.needs_escalation(BLUEPRINT, plain), "a valid blueprint should not escalate")
+    expect(not TieredModelRouter.needs_escalation(BLUEPRINT, refine), "a client refine intent should not escalate a blueprint")
+    expect(TieredModelRouter.needs_escalation(BLUEPRINT, section), "a whole blueprint for one section should escalate")
+    expect(not TieredModelRouter.needs_escalation("Warmer hero copy", section), "a section reply should not escalate")
+
+
+def check_slot_spillover():
+    router = make_router(FakeLLM(responses=["fast reply"]), fast_slots=1)
+    router.fast.slots.acquire()
+    try:
+        expect(router.invoke(MESSAGES, intent="clarify") == "strong reply", "a busy fast tier did not spill over")
+    finally:
+        router.fast.slots.release()
+    expect(router.metrics()["spillovers"] == 1, "the spillover was not counted")
+    expect(router.invoke(MESSAGES, intent="clarify") == "fast reply", "a free fast tier was skipped")
+
+
+def check_tier_escalation():
+    router = make_router(FakeLLM(responses=[""]))
+    expect(router.invoke(MESSAGES, intent="clarify") == "strong reply", "an empty fast reply was not escalated")
+
+    router = make_router(failing_tier())
+    expect(router.invoke(MESSAGES, intent="clarify") == "strong reply", "a transient fast failure was not escalated")
+    expect(router.metrics()["escalations"] == 1, "the escalation was not counted")
+
+    router = make_router(failing_tier(BadRequest))
+    try:
+        router.invoke(MESSAGES, intent="clarify")
+        expect(False, "a rejected request should not be escalated")
+    except LLMUnavailableError:
+        pass
+    metrics = router.metrics()
+    expect(metrics["escalations"] == 0 and metrics["tiers"]["strong"]["calls"] == 0, "a bad request reached strong")
+
+
+def check_stream_routing():
+    router = make_router(failing_tier(), FakeLLM(responses=["strong streamed reply"]))
+    reply = "".join(router.stream(MESSAGES, intent="clarify"))
+    expect(reply == "strong streamed reply", "a fast stream failing before its first chunk was not escalated")
+    decision = router.metrics()["recent_decisions"][-1]
+    expect(decision["escalated"] and decision["outcome"] == "completed", f"unexpected decision {decision}")
+
+    # Closing an abandoned stream frees the slot at once
+    router = make_router(FakeLLM(responses=["one two three"]), fast_slots=1)
+    stream = router.stream(MESSAGES, intent="clarify")
+    next(stream)
+    stream.close()
+    expect(router.fast.slots.acquire(blocking=False), "an abandoned stream kept its slot")
+    router.fast.slots.release()
+    expect(router.metrics()["recent_decisions"][-1]["outcome"] == "abandoned", "the abandoned stream was not recorded")
+
+
+CHECKS = [
+    ("retries exhausted", check_retries_exhausted),
+    ("retry budget exhausted", check_retry_budget_exhausted),
+    ("deadline timeout", check_deadline_timeout),
+    ("breaker open -> half-open -> closed", check_breaker_cycle),
+    ("bad requests keep the breaker closed", check_bad_requests_keep_breaker_closed),
+    ("hedge wins", check_hedge_wins),
+    ("prompt cache create / refresh / fallback", check_prompt_cache),
+    ("routing choice", check_routing_choice),
+    ("escalation rules", check_escalation_rules),
+    ("slot spillover", check_slot_spillover),
+    ("tier escalation", check_tier_escalation),
+    ("stream routing", check_stream_routing),
+]
+
+
+def main():
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            check()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
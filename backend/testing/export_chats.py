@@ -0,0 +1,45 @@
+"""
+Admin backup: dump every chat to NDJSON or Markdown without loading collections into memory
+
+Usage:
+    python testing/export_chats.py --output backup.ndjson.gz --gzip
+    python testing/export_chats.py --format markdown --output backup.md --after <last cursor>
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.mongodb_service import MongoDBService
+from services.export_service import ChatExporter
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export all chats for backup")
+    parser.add_argument("--format", choices=list(ChatExporter.FORMATS), default="ndjson")
+    parser.add_argument("--output", required=True, help="File to write the export to")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output stream")
+    parser.add_argument("--after", default=None, help="Resume after this chat id (cursor)")
+    args = parser.parse_args()
+
+    mongo_service = MongoDBService()
+    exporter = ChatExporter(include_system=True)
+
+    chats = mongo_service.iter_chats(after_id=args.after)
+    written = 0
+    with open(args.output, "wb") as output:
+        for chunk in exporter.iter_export(chats, args.format, compress=args.gzip):
+            output.write(chunk)
+            written += len(chunk)
+
+    print(f"✅ Export written to {args.output} ({written} bytes)")
+
+
+if __name__ == "__main__":
+    main()